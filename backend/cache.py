@@ -0,0 +1,78 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = "response_cache.db"
+# Total size of cached answers, the least recently used ones go first
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+REPLAY_PATTERN = re.compile(r"\s*\S+\s*")
+
+
+def replay(text):
+    # A cached answer goes through the same streaming path as a live one
+    for match in REPLAY_PATTERN.finditer(text):
+        yield match.group()
+
+
+class ResponseCache:
+    # Answers to exact repeats of a question, keyed by a hash of everything
+    # that goes into the request. Used from the worker threads, so the
+    # connection is shared under a lock.
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    used_at REAL NOT NULL
+                )""")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_by_use ON responses (used_at)")
+            self.size = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model, system, options, messages):
+        data = json.dumps([model, system, options, messages], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, response):
+        size = len(response.encode())
+        if not response or size > self.max_bytes:
+            return
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, used_at) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()))
+            self.size += size - (row[0] if row else 0)
+            while self.size > self.max_bytes:
+                key, size = self.connection.execute(
+                    "SELECT key, size FROM responses ORDER BY used_at LIMIT 1").fetchone()
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,59 @@
+import re
+from functools import lru_cache
+
+# Tokens of earlier turns sent with a question, the newest turns are kept
+HISTORY_TOKENS = 2048
+# Distinct message texts whose estimate is remembered
+TOKEN_CACHE_SIZE = 8192
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def estimate_tokens(text):
+    # Words and punctuation marks, long words count as several subword tokens.
+    # Cached by text, so each message is only scanned once per run.
+    tokens = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        tokens += 1 + len(match.group()) // 8
+    return tokens
+
+
+def turn_tokens(turn):
+    return estimate_tokens(turn["prompt"]) + estimate_tokens(turn["response"])
+
+
+def history_window(history, budget=HISTORY_TOKENS):
+    # The most recent turns that fit in the budget, oldest first. Older turns
+    # are dropped whole, a turn is never cut in half.
+    window = []
+    used = 0
+    for turn in reversed(history):
+        used += turn_tokens(turn)
+        if used > budget:
+            break
+        window.append(turn)
+    window.reverse()
+    return window
+
+
+def history_prompt(user_input, history, budget=HISTORY_TOKENS):
+    # The same window as plain text, for generate calls that have no context yet
+    window = history_window(history, budget)
+    if not window:
+        return user_input
+    lines = ["Earlier in this conversation:"]
+    for turn in window:
+        lines.append(f"User: {turn['prompt']}")
+        lines.append(f"Assistant: {turn['response']}")
+    lines.append("")
+    lines.append(user_input)
+    return "\n".join(lines)
+
+
+def history_messages(history, budget=HISTORY_TOKENS):
+    messages = []
+    for turn in history_window(history, budget):
+        messages.append({'role': 'user', 'content': turn["prompt"]})
+        messages.append({'role': 'assistant', 'content': turn["response"]})
+    return messages
@@ -0,0 +1,277 @@
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import httpcore
+import httpx
+import ollama
+
+# Seconds a failed endpoint is skipped before it is tried again
+RETRY_AFTER = 30.0
+# Weight of the newest time-to-first-token in an endpoint's running average
+TTFT_SMOOTHING = 0.3
+
+# The cancellation of the request running on each thread, see Cancellation.watching
+_current = threading.local()
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Cancellation:
+    # Stops a request from another thread, also while it is still waiting for
+    # the first byte (model load, prefill). The connection the request reads
+    # from is shut down, which Ollama sees as the client going away.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.streams = set()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            streams = list(self.streams)
+        for stream in streams:
+            stream.abort()
+
+    def attach(self, stream):
+        with self.lock:
+            if not self.event.is_set():
+                self.streams.add(stream)
+                return
+        stream.abort()
+
+    @contextmanager
+    def watching(self):
+        # Connections used on this thread inside the block belong to this
+        # request, they go back to the pool for others afterwards
+        previous = getattr(_current, "cancellation", None)
+        _current.cancellation = self
+        try:
+            yield
+        finally:
+            _current.cancellation = previous
+            with self.lock:
+                self.streams.clear()
+
+
+class CancellableStream(httpcore.NetworkStream):
+    # A connection that registers with the cancellation of whoever uses it
+    def __init__(self, stream):
+        self.stream = stream
+
+    def attach(self):
+        cancellation = getattr(_current, "cancellation", None)
+        if cancellation is not None:
+            cancellation.attach(self)
+
+    def abort(self):
+        # Wakes up a read blocked on another thread, close() would not
+        sock = self.stream.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def read(self, max_bytes, timeout=None):
+        self.attach()
+        return self.stream.read(max_bytes, timeout)
+
+    def write(self, buffer, timeout=None):
+        self.attach()
+        self.stream.write(buffer, timeout)
+
+    def close(self):
+        self.stream.close()
+
+    def start_tls(self, ssl_context, server_hostname=None, timeout=None):
+        return CancellableStream(self.stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info):
+        return self.stream.get_extra_info(info)
+
+
+class CancellableBackend(httpcore.SyncBackend):
+    def connect_tcp(self, *args, **kwargs):
+        return CancellableStream(super().connect_tcp(*args, **kwargs))
+
+    def connect_unix_socket(self, *args, **kwargs):
+        return CancellableStream(super().connect_unix_socket(*args, **kwargs))
+
+
+def cancellable_transport(limits):
+    transport = httpx.HTTPTransport(limits=limits)
+    # httpx has no option for the network backend, so its private pool is
+    # replaced with one using httpcore's public backend API. Should a later
+    # httpx keep its pool elsewhere, the plain transport is used and a
+    # cancellation only takes effect at the next chunk.
+    if not isinstance(getattr(transport, "_pool", None), httpcore.ConnectionPool):
+        return transport
+    transport._pool = httpcore.ConnectionPool(
+        ssl_context=httpx.create_ssl_context(),
+        max_connections=limits.max_connections,
+        max_keepalive_connections=limits.max_keepalive_connections,
+        keepalive_expiry=limits.keepalive_expiry,
+        network_backend=CancellableBackend(),
+    )
+    return transport
+
+
+def server_failed(error):
+    # Whether the server itself is at fault: it could not be reached, broke
+    # off or answered with a 5xx. A 4xx (say the model isn't pulled there)
+    # is about the request, the server stays in rotation. ResponseErrors
+    # reported inside a stream carry no status (-1) and count as failures.
+    if isinstance(error, ollama.ResponseError):
+        return not 400 <= error.status_code < 500
+    return True
+
+
+class Endpoint:
+    def __init__(self, host, limits=httpx.Limits(), **client_args):
+        self.host = host
+        self.client = ollama.Client(host=host, transport=cancellable_transport(limits), **client_args)
+        self.in_flight = 0
+        self.ttft = 0.0  # smoothed seconds, 0 until the first answer
+        self.failed_at = None
+
+    def healthy(self, now):
+        return self.failed_at is None or now - self.failed_at >= RETRY_AFTER
+
+    def load(self):
+        # Expected wait for a new request, in-flight count breaks ties while
+        # no time-to-first-token has been measured
+        return (self.in_flight + 1) * self.ttft, self.in_flight
+
+
+class EndpointPool:
+    # Ollama servers that can answer the same model. Requests go to the least
+    # loaded healthy one and move to the next when a server fails before it
+    # has produced anything. A server that is unreachable or answers with a
+    # 5xx is skipped for RETRY_AFTER seconds.
+    def __init__(self, hosts, **client_args):
+        if not hosts:
+            raise ValueError("EndpointPool needs at least one host")
+        self.endpoints = [Endpoint(host, **client_args) for host in hosts]
+        self.lock = threading.Lock()
+
+    def acquire(self, exclude=()):
+        with self.lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            if not candidates:
+                return None
+            # When every server has failed recently, still try the least recent failure
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy(now)]
+            if healthy:
+                endpoint = min(healthy, key=Endpoint.load)
+            else:
+                endpoint = min(candidates, key=lambda endpoint: endpoint.failed_at)
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint, failed=False):
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.failed_at = time.monotonic() if failed else None
+
+    def first_token(self, endpoint, seconds):
+        with self.lock:
+            if endpoint.ttft:
+                endpoint.ttft += TTFT_SMOOTHING * (seconds - endpoint.ttft)
+            else:
+                endpoint.ttft = seconds
+
+    def stream(self, method, cancellation=None, **kwargs):
+        # Streams from the first server that produces a chunk. Once it has,
+        # errors are the caller's, the answer can't continue elsewhere.
+        # Cancelled is raised when the cancellation ends the request.
+        cancellation = cancellation or Cancellation()
+        with cancellation.watching():
+            tried = []
+            error = None
+            while True:
+                endpoint = self.acquire(tried)
+                if endpoint is None:
+                    raise error
+                tried.append(endpoint)
+                started = time.monotonic()
+                stream = None
+                try:
+                    stream = getattr(endpoint.client, method)(stream=True, **kwargs)
+                    first = next(stream)
+                except StopIteration:
+                    self.release(endpoint)
+                    return
+                except Exception as stream_error:
+                    if stream is not None:
+                        stream.close()
+                    if cancellation.is_set():
+                        # Not the server's fault, and not to be retried elsewhere
+                        self.release(endpoint)
+                        raise Cancelled() from stream_error
+                    self.release(endpoint, failed=server_failed(stream_error))
+                    error = stream_error
+                    continue
+                self.first_token(endpoint, time.monotonic() - started)
+                try:
+                    yield first
+                    yield from stream
+                except Exception as stream_error:
+                    if cancellation.is_set():
+                        raise Cancelled() from stream_error
+                    raise
+                finally:
+                    stream.close()
+                    self.release(endpoint)
+                return
+
+    def call(self, method, **kwargs):
+        # A request without streaming, on the first server that answers
+        tried = []
+        error = None
+        while True:
+            endpoint = self.acquire(tried)
+            if endpoint is None:
+                raise error
+            tried.append(endpoint)
+            try:
+                result = getattr(endpoint.client, method)(**kwargs)
+            except Exception as call_error:
+                self.release(endpoint, failed=server_failed(call_error))
+                error = call_error
+                continue
+            self.release(endpoint)
+            return result
+
+    def call_all(self, method, **kwargs):
+        # The same request on every server, e.g. to load the model everywhere.
+        # Fails only when no server succeeded.
+        error = None
+        succeeded = False
+        for endpoint in self.endpoints:
+            with self.lock:
+                endpoint.in_flight += 1
+            try:
+                getattr(endpoint.client, method)(**kwargs)
+            except Exception as call_error:
+                self.release(endpoint, failed=server_failed(call_error))
+                error = call_error
+                continue
+            self.release(endpoint)
+            succeeded = True
+        if not succeeded and error is not None:
+            raise error
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.client.close()
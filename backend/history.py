@@ -0,0 +1,731 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from backend.metrics import get_metrics
+
+HISTORY_FILE = "chat_history.json"
+HISTORY_DB = "chat_history.db"
+HISTORY_JOURNAL = "chat_history.jsonl"
+
+# Which persistence layer the shared store uses: "sqlite", "journal" or "json"
+HISTORY_BACKEND = "sqlite"
+
+# Journal size after which it is folded into a snapshot in the background
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+# How many lazily loaded session transcripts the store keeps in memory
+CONTENT_CACHE_SESSIONS = 16
+
+# Longest time, in seconds, a change waits before the writer thread persists it
+FLUSH_INTERVAL = 0.5
+
+# A batch that fails to write (e.g. the database is locked by another
+# process) is retried after a delay that doubles up to the maximum, seconds
+WRITE_RETRY_DELAY = 0.25
+WRITE_RETRY_MAX_DELAY = 8.0
+# Failed attempts in a row after which flush() and close() give up and raise
+WRITE_ATTEMPTS = 5
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_atomically(path, data):
+    # Write to a temp file, fsync it and rename it over the target, so a
+    # crash leaves either the old or the new file but never a truncated one
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def normalize_sessions(sessions):
+    # Older files numbered sessions by list length, so ids can repeat or be missing
+    seen = set()
+    for session in sessions:
+        session.setdefault("message", "Chat Session")
+        session.setdefault("content", [])
+        if session.get("chat_id") is None or session["chat_id"] in seen:
+            session["chat_id"] = max(seen, default=0) + 1
+        seen.add(session["chat_id"])
+    return sessions
+
+
+class JsonHistoryBackend:
+    # Persists the whole history as a single JSON document, a batch of
+    # changes rewrites the file once.
+    #
+    # Backends receive store changes through write_batch(changes, lock) on
+    # the writer thread, changes being (method name, session, ...) tuples in
+    # the order they happened; lock guards the store's shared session dicts.
+    # Eager backends (lazy = False) load sessions with their content, lazy
+    # ones provide load_content(chat_id) instead. changed_externally() tells
+    # writes by other processes from our own.
+    lazy = False
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.sessions = []
+        self.digest = None
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            self.sessions = []
+            self.digest = None
+            return self.sessions
+        self.sessions = normalize_sessions(json.loads(data))
+        self.digest = hashlib.sha1(data).hexdigest()
+        return self.sessions
+
+    def write_batch(self, changes, lock):
+        with lock:
+            data = json.dumps(self.sessions).encode()
+        # Record the digest first so the watcher never sees our own write as foreign
+        self.digest = hashlib.sha1(data).hexdigest()
+        write_atomically(self.path, data)
+
+    def watch_paths(self):
+        return [self.path]
+
+    def changed_externally(self):
+        try:
+            with open(self.path, 'rb') as file:
+                return hashlib.sha1(file.read()).hexdigest() != self.digest
+        except FileNotFoundError:
+            return self.digest is not None
+
+    def close(self):
+        pass
+
+
+class SqliteHistoryBackend:
+    # Stores sessions and messages in SQLite, a new message is a single insert.
+    # load() only reads the session index, transcripts are read on demand.
+    lazy = True
+    SCHEMA_VERSION = 1
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            chat_id INTEGER PRIMARY KEY,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL REFERENCES sessions(chat_id) ON DELETE CASCADE,
+            prompt TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            metrics TEXT
+        );
+        CREATE INDEX IF NOT EXISTS messages_by_chat ON messages(chat_id, id);
+    """
+
+    def __init__(self, path=HISTORY_DB, json_path=HISTORY_FILE):
+        self.path = path
+        # Shared by the GUI thread (reads) and the writer thread, one at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection_lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(self.SCHEMA)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            self.migrate_json(json_path)
+        # Only changes when another connection commits, our own writes keep it
+        self.data_version = self.read_data_version()
+
+    def read_data_version(self):
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def watch_paths(self):
+        return [self.path, self.path + "-wal"]
+
+    def changed_externally(self):
+        with self.connection_lock:
+            data_version = self.read_data_version()
+        changed = data_version != self.data_version
+        self.data_version = data_version
+        return changed
+
+    def migrate_json(self, json_path):
+        # One-time import of the old JSON history, the file is kept as a backup
+        sessions = []
+        if json_path and os.path.exists(json_path):
+            with open(json_path, 'r') as file:
+                sessions = normalize_sessions(json.load(file))
+        now = time.time()
+        with self.connection:
+            for session in sessions:
+                self.connection.execute(
+                    "INSERT INTO sessions (chat_id, message, created_at, updated_at, message_count) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (session["chat_id"], session["message"], now, now, len(session["content"])))
+                self.connection.executemany(
+                    "INSERT INTO messages (chat_id, prompt, response, created_at, metrics) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(session["chat_id"], item["prompt"], item["response"], now,
+                      json.dumps(item["metrics"]) if item.get("metrics") else None)
+                     for item in session["content"]])
+            self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        if sessions:
+            os.replace(json_path, json_path + ".migrated")
+
+    def load(self):
+        with self.connection_lock:
+            return [
+                {"chat_id": chat_id, "message": message, "created_at": created_at,
+                 "updated_at": updated_at, "message_count": message_count}
+                for chat_id, message, created_at, updated_at, message_count in self.connection.execute(
+                    "SELECT chat_id, message, created_at, updated_at, message_count "
+                    "FROM sessions ORDER BY chat_id")
+            ]
+
+    def load_content(self, chat_id):
+        with self.connection_lock:
+            rows = self.connection.execute(
+                "SELECT prompt, response, metrics FROM messages WHERE chat_id = ? ORDER BY id",
+                (chat_id,)).fetchall()
+        content = []
+        for prompt, response, metrics in rows:
+            message = {"prompt": prompt, "response": response}
+            if metrics:
+                message["metrics"] = json.loads(metrics)
+            content.append(message)
+        return content
+
+    def write_batch(self, changes, lock):
+        # The whole batch is one transaction
+        with self.connection_lock, self.connection:
+            for method, *args in changes:
+                getattr(self, method)(*args)
+
+    def session_created(self, session):
+        self.connection.execute(
+            "INSERT INTO sessions (chat_id, message, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (session["chat_id"], session["message"], session["created_at"], session["updated_at"]))
+
+    def session_updated(self, session):
+        self.connection.execute(
+            "UPDATE sessions SET message = ?, updated_at = ? WHERE chat_id = ?",
+            (session["message"], session["updated_at"], session["chat_id"]))
+
+    def message_added(self, session, message):
+        self.connection.execute(
+            "INSERT INTO messages (chat_id, prompt, response, created_at, metrics) VALUES (?, ?, ?, ?, ?)",
+            (session["chat_id"], message["prompt"], message["response"], session["updated_at"],
+             json.dumps(message["metrics"]) if message.get("metrics") else None))
+        self.connection.execute(
+            "UPDATE sessions SET message = ?, updated_at = ?, message_count = message_count + 1 "
+            "WHERE chat_id = ?",
+            (session["message"], session["updated_at"], session["chat_id"]))
+
+    def session_deleted(self, session):
+        self.connection.execute("DELETE FROM sessions WHERE chat_id = ?", (session["chat_id"],))
+
+    def close(self):
+        with self.connection_lock:
+            self.connection.close()
+
+
+class JournalHistoryBackend:
+    # Appends one JSON line per change to a journal on top of a snapshot.
+    # Every record carries a sequence number and the snapshot remembers the
+    # last one it contains, so replay after a crash never applies a record
+    # twice. A torn last line from a crash mid-write is dropped on load.
+    lazy = False
+
+    def __init__(self, path=HISTORY_JOURNAL, json_path=HISTORY_FILE,
+                 compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.compacting_path = path + ".compacting"
+        self.json_path = json_path
+        self.compact_bytes = compact_bytes
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.journal = None
+        self.compactor = None
+        # Size and mtime of our files after our own last write
+        self.stamp = None
+
+    def load(self):
+        if self.compactor:
+            self.compactor.join()
+        with self.lock:
+            if self.journal:
+                self.journal.close()
+            self.migrate_json()
+            snapshot_seq, sessions = self.read_snapshot()
+            by_id = {session["chat_id"]: session for session in sessions}
+            self.seq = snapshot_seq
+            # A leftover compacting journal means a compaction was interrupted,
+            # it is folded into the snapshot here so compaction can run again
+            if os.path.exists(self.compacting_path):
+                self.seq = self.replay(self.compacting_path, snapshot_seq, sessions, by_id)
+                self.write_snapshot(self.seq, sessions)
+                os.remove(self.compacting_path)
+            self.seq = max(self.seq, self.replay(self.path, self.seq, sessions, by_id))
+            self.journal = open(self.path, 'a')
+            self.stamp = self.file_stamps()
+        return sessions
+
+    def file_stamps(self):
+        return file_stamp(self.path), file_stamp(self.snapshot_path)
+
+    def watch_paths(self):
+        return [self.path, self.snapshot_path]
+
+    def changed_externally(self):
+        with self.lock:
+            return self.file_stamps() != self.stamp
+
+    def migrate_json(self):
+        # One-time import of the old JSON history as the first snapshot
+        if os.path.exists(self.snapshot_path) or os.path.exists(self.path):
+            return
+        if not (self.json_path and os.path.exists(self.json_path)):
+            return
+        with open(self.json_path, 'r') as file:
+            sessions = normalize_sessions(json.load(file))
+        self.write_snapshot(0, sessions)
+        os.replace(self.json_path, self.json_path + ".migrated")
+
+    def read_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r') as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return 0, []
+        return snapshot["seq"], snapshot["sessions"]
+
+    def write_snapshot(self, seq, sessions):
+        write_atomically(self.snapshot_path, json.dumps({"seq": seq, "sessions": sessions}).encode())
+
+    def replay(self, path, after_seq, sessions, by_id):
+        last_seq = after_seq
+        try:
+            file = open(path, 'rb+')
+        except FileNotFoundError:
+            return last_seq
+        with file:
+            good_offset = 0
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good_offset += len(line)
+                if record["seq"] > after_seq:
+                    apply_record(record, sessions, by_id)
+                    last_seq = record["seq"]
+            file.truncate(good_offset)
+        return last_seq
+
+    def write_batch(self, changes, lock):
+        # One write and one fsync for the whole batch
+        with lock:
+            records = [getattr(self, method)(*args) for method, *args in changes]
+        with self.lock:
+            seq = self.seq
+            offset = self.journal.tell()
+            lines = []
+            for record in records:
+                self.seq += 1
+                record["seq"] = self.seq
+                lines.append(json.dumps(record) + "\n")
+            try:
+                self.journal.write("".join(lines))
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+            except Exception:
+                # Undone, so the retried batch is neither torn nor doubled
+                self.seq = seq
+                try:
+                    self.journal.close()
+                except OSError:
+                    pass
+                os.truncate(self.path, offset)
+                self.journal = open(self.path, 'a')
+                raise
+            size = self.journal.tell()
+            self.stamp = self.file_stamps()
+        if size >= self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        # Rotate the journal and fold it into a new snapshot on a background
+        # thread, new records keep going to a fresh journal meanwhile
+        with self.lock:
+            if self.compactor and self.compactor.is_alive():
+                return
+            if os.path.exists(self.compacting_path):
+                return
+            self.journal.close()
+            os.replace(self.path, self.compacting_path)
+            self.journal = open(self.path, 'a')
+            self.stamp = self.file_stamps()
+        self.compactor = threading.Thread(target=self.fold_compacting_journal, daemon=True)
+        self.compactor.start()
+
+    def fold_compacting_journal(self):
+        snapshot_seq, sessions = self.read_snapshot()
+        by_id = {session["chat_id"]: session for session in sessions}
+        seq = self.replay(self.compacting_path, snapshot_seq, sessions, by_id)
+        self.write_snapshot(seq, sessions)
+        with self.lock:
+            os.remove(self.compacting_path)
+            self.stamp = self.file_stamps()
+
+    def session_created(self, session):
+        return {"op": "create", "chat_id": session["chat_id"], "message": session["message"]}
+
+    def session_updated(self, session):
+        return {"op": "update", "chat_id": session["chat_id"], "message": session["message"]}
+
+    def message_added(self, session, message):
+        record = {"op": "message", "chat_id": session["chat_id"], "message": session["message"],
+                  "prompt": message["prompt"], "response": message["response"]}
+        if message.get("metrics"):
+            record["metrics"] = message["metrics"]
+        return record
+
+    def session_deleted(self, session):
+        return {"op": "delete", "chat_id": session["chat_id"]}
+
+    def close(self):
+        if self.compactor:
+            self.compactor.join()
+        with self.lock:
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+
+
+def apply_record(record, sessions, by_id):
+    chat_id = record["chat_id"]
+    if record["op"] == "create":
+        session = {"chat_id": chat_id, "message": record["message"], "content": []}
+        sessions.append(session)
+        by_id[chat_id] = session
+    elif record["op"] == "update":
+        by_id[chat_id]["message"] = record["message"]
+    elif record["op"] == "message":
+        session = by_id[chat_id]
+        session["message"] = record["message"]
+        message = {"prompt": record["prompt"], "response": record["response"]}
+        if "metrics" in record:
+            message["metrics"] = record["metrics"]
+        session["content"].append(message)
+    elif record["op"] == "delete":
+        sessions.remove(by_id.pop(chat_id))
+
+
+def open_backend(kind=HISTORY_BACKEND):
+    if kind == "sqlite":
+        return SqliteHistoryBackend()
+    if kind == "journal":
+        return JournalHistoryBackend()
+    if kind == "json":
+        return JsonHistoryBackend()
+    raise ValueError(f"Unknown history backend: {kind}")
+
+
+class HistoryWriteError(Exception):
+    pass
+
+
+class HistoryWriter:
+    # Persists store changes on a background thread. The first change of a
+    # batch waits up to flush_interval for more, so a burst of edits costs one
+    # write; flush() blocks until everything submitted is on disk.
+    #
+    # A batch that fails goes back to the front of the queue and is retried
+    # with backoff, nothing is dropped while the app runs. on_error(error) is
+    # called on the writer thread after each failed attempt. flush() raises
+    # HistoryWriteError after WRITE_ATTEMPTS failures in a row, close() when
+    # changes could not be written before the writer stopped.
+    def __init__(self, backend, lock, flush_interval=FLUSH_INTERVAL, on_error=None):
+        self.backend = backend
+        self.lock = lock
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.pending = []
+        self.writing = False
+        self.flush_requested = False
+        self.closing = False
+        # Failed attempts in a row at the batch at the front of pending
+        self.failures = 0
+        self.error = None
+        self.lost = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="history-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, method, *args):
+        with self.condition:
+            self.pending.append((method, *args))
+            self.condition.notify_all()
+
+    def has_pending(self):
+        with self.condition:
+            return bool(self.pending) or self.writing
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                if self.closing and self.failures >= WRITE_ATTEMPTS:
+                    # Nothing left to retry for, close() reports what is lost
+                    self.lost = len(self.pending)
+                    self.pending = []
+                    self.condition.notify_all()
+                    return
+                if self.failures:
+                    delay = min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_DELAY * 2 ** (self.failures - 1))
+                    self.wait_until(time.monotonic() + delay, lambda: False)
+                else:
+                    self.wait_until(time.monotonic() + self.flush_interval,
+                                    lambda: self.flush_requested or self.closing)
+                batch, self.pending = self.pending, []
+                self.writing = True
+                self.flush_requested = False
+            started = time.perf_counter()
+            try:
+                self.backend.write_batch(batch, self.lock)
+            except Exception as error:
+                get_metrics().increment("history_write_errors_total")
+                traceback.print_exc()
+                with self.condition:
+                    # Retried first, later changes stay behind it in order
+                    self.pending = batch + self.pending
+                    self.failures += 1
+                    self.error = error
+                    self.writing = False
+                    self.condition.notify_all()
+                if self.on_error is not None:
+                    try:
+                        self.on_error(error)
+                    except Exception:
+                        traceback.print_exc()
+                continue
+            get_metrics().observe("history_write_seconds", time.perf_counter() - started)
+            get_metrics().increment("history_changes_written_total", len(batch))
+            with self.condition:
+                self.writing = False
+                self.failures = 0
+                self.error = None
+                self.condition.notify_all()
+
+    def wait_until(self, deadline, done):
+        while not done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.condition.wait(remaining)
+
+    def flush(self):
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            while (self.pending or self.writing) and self.failures < WRITE_ATTEMPTS:
+                self.condition.wait()
+            self.flush_requested = False
+            if self.pending or self.writing:
+                raise HistoryWriteError(
+                    f"{len(self.pending)} history changes could not be written: {self.error}") from self.error
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join()
+        if self.lost:
+            raise HistoryWriteError(
+                f"{self.lost} history changes could not be written: {self.error}") from self.error
+
+
+class ChatHistoryStore:
+    # The one in-process owner of the chat history, shared by every widget.
+    # Listeners are called with (event, session) where event is one of
+    # "created", "updated", "deleted" or "reloaded" (session is None).
+    # Changes are applied in memory right away and written by a HistoryWriter,
+    # mutations hold self.lock so the writer never sees them half done.
+    # Error listeners are called with the exception of a failed write, on the
+    # writer thread.
+    def __init__(self, backend=None, flush_interval=FLUSH_INTERVAL):
+        self.backend = backend or open_backend()
+        self.lock = threading.RLock()
+        self.error_listeners = []
+        self.writer = HistoryWriter(self.backend, self.lock, flush_interval, self.write_failed)
+        self.sessions = []
+        self.by_id = {}
+        # Transcripts of lazy backends, most recently used last
+        self.contents = OrderedDict()
+        self.last_id = 0
+        self.listeners = []
+        self.load()
+
+    def load(self):
+        self.writer.flush()
+        self.sessions = self.backend.load()
+        self.by_id = {}
+        self.contents.clear()
+        for session in self.sessions:
+            if "content" in session:
+                session["message_count"] = len(session["content"])
+            self.by_id[session["chat_id"]] = session
+        self.notify("reloaded", None)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def notify(self, event, session):
+        for listener in list(self.listeners):
+            listener(event, session)
+
+    def subscribe_errors(self, listener):
+        self.error_listeners.append(listener)
+
+    def write_failed(self, error):
+        for listener in list(self.error_listeners):
+            listener(error)
+
+    def get(self, chat_id):
+        return self.by_id.get(chat_id)
+
+    def latest(self):
+        return self.sessions[-1] if self.sessions else None
+
+    def get_content(self, chat_id):
+        # Sessions from eager backends carry their content, lazy ones are
+        # read from the backend the first time they are opened
+        session = self.get(chat_id)
+        if session is None:
+            return []
+        if "content" in session:
+            return session["content"]
+        content = self.contents.pop(chat_id, None)
+        if content is None:
+            # Messages still queued for the writer are not in the backend yet
+            try:
+                self.writer.flush()
+            except HistoryWriteError:
+                pass  # shown as far as written, the writer keeps retrying
+            content = self.backend.load_content(chat_id)
+        self.contents[chat_id] = content
+        while len(self.contents) > CONTENT_CACHE_SESSIONS:
+            self.contents.popitem(last=False)
+        return content
+
+    def next_id(self):
+        # Ids are not reused after a delete within a run
+        self.last_id = max(self.last_id, max(self.by_id, default=0)) + 1
+        return self.last_id
+
+    def create_session(self, message="Chat Session"):
+        now = time.time()
+        session = {"chat_id": self.next_id(), "message": message, "created_at": now,
+                   "updated_at": now, "message_count": 0}
+        if self.backend.lazy:
+            self.contents[session["chat_id"]] = []
+        else:
+            session["content"] = []
+        with self.lock:
+            self.sessions.append(session)
+            self.by_id[session["chat_id"]] = session
+        self.writer.submit("session_created", session)
+        self.notify("created", session)
+        return session
+
+    def add_message(self, chat_id, prompt, response, metrics=None):
+        # metrics are the answer's generation timings, kept with the message
+        session = self.get(chat_id)
+        if session is None:
+            session = self.create_session(prompt)
+        message = {"prompt": prompt, "response": response}
+        if metrics:
+            message["metrics"] = metrics
+        with self.lock:
+            if not session["message_count"]:
+                # A fresh session takes its title from the first prompt
+                session["message"] = prompt
+            if "content" in session:
+                session["content"].append(message)
+            elif session["chat_id"] in self.contents:
+                self.contents[session["chat_id"]].append(message)
+            session["message_count"] += 1
+            session["updated_at"] = time.time()
+        self.writer.submit("message_added", session, message)
+        self.notify("updated", session)
+        return session
+
+    def rename_session(self, chat_id, message):
+        session = self.get(chat_id)
+        if session is None:
+            return
+        with self.lock:
+            session["message"] = message
+            session["updated_at"] = time.time()
+        self.writer.submit("session_updated", session)
+        self.notify("updated", session)
+
+    def delete_session(self, chat_id):
+        with self.lock:
+            session = self.by_id.pop(chat_id, None)
+            if session is None:
+                return
+            self.sessions.remove(session)
+        self.contents.pop(chat_id, None)
+        self.writer.submit("session_deleted", session)
+        self.notify("deleted", session)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        # Synchronous, everything submitted is written before the backend closes
+        self.writer.close()
+        self.backend.close()
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = ChatHistoryStore()
+    return _store
+
+
+def set_store(store):
+    # Makes get_store() return another store, None opens the default one again
+    global _store
+    _store = store
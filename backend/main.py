@@ -1,14 +1,281 @@
-import ollama
+import threading
+import time
+from collections import OrderedDict
 
+import httpx
 
-def get_response(user_input):
-    stream = ollama.chat(
-        model='onecern',
-        messages=[
-            {'role': 'system', 'content': "You are the Singapore QP's Board of Architect expert, the person is sitting for the QP examination, please help with finding the references and stuff needed for the exam"},
+from backend.cache import ResponseCache, replay
+from backend.endpoints import Cancelled, EndpointPool
+from backend.metrics import get_metrics, ollama_timings
+from backend.replay import RecordingEndpoints
+from backend.context import HISTORY_TOKENS, history_messages, history_prompt
+from backend.semantic_cache import EMBED_DIMENSIONS, EMBED_MODEL, SEMANTIC_CACHE, SemanticCache, numpy
+
+MODEL = 'onecern'
+SYSTEM_PROMPT = "You are the Singapore QP's Board of Architect expert, the person is sitting for the QP examination, please help with finding the references and stuff needed for the exam"
+
+# Ollama servers that all serve MODEL, e.g. ['http://10.0.0.5:11434', ...].
+# None is the OLLAMA_HOST environment variable, or the local default.
+OLLAMA_HOSTS = [None]
+CONNECT_TIMEOUT = 5.0
+# Longest wait for the next streamed chunk, a cold model load comes first
+READ_TIMEOUT = 300.0
+# How long Ollama keeps the model in memory after the last request
+KEEP_ALIVE = '30m'
+# Model options (temperature, num_ctx, ...), None keeps the Modelfile's
+OPTIONS = None
+MAX_CONNECTIONS = 4
+
+# "chat" replays the session's turns with every question, "generate" passes
+# back the context tokens Ollama returned for the previous answer, so only
+# the new question has to be processed. generate is opt-in: it relies on
+# Ollama's deprecated context field and on the raw prompt, not the chat template.
+GENERATION_MODE = 'chat'
+# Sessions whose context tokens are kept, most recently used last
+CONTEXT_SESSIONS = 8
+# Fixture file that every streamed answer is appended to, for replaying
+# them in benchmarks (backend.replay), None records nothing
+RECORD_PATH = None
+
+
+class OllamaClient:
+    # One set of HTTP clients for the whole app, so requests reuse pooled
+    # connections and every request asks Ollama to keep the model loaded
+    def __init__(self, hosts=OLLAMA_HOSTS, model=MODEL, keep_alive=KEEP_ALIVE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_connections=MAX_CONNECTIONS, history_tokens=HISTORY_TOKENS,
+                 mode=GENERATION_MODE, options=OPTIONS, cache=None, semantic_cache=None,
+                 endpoints=None):
+        # endpoints replaces the Ollama servers, e.g. with a ReplayEndpoints
+        self.model = model
+        self.keep_alive = keep_alive
+        self.history_tokens = history_tokens
+        self.mode = mode
+        self.options = options
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        # session -> (number of turns it covers, context tokens)
+        self.contexts = OrderedDict()
+        self.contexts_lock = threading.Lock()
+        if endpoints is None:
+            endpoints = EndpointPool(
+                hosts,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections),
+            )
+        self.endpoints = endpoints
+
+    def messages(self, user_input, history=()):
+        # Earlier turns of the session go between the system prompt and the
+        # question, as many recent ones as fit in the history budget
+        return [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            *history_messages(history, self.history_tokens),
             {'role': 'user', 'content': user_input}
-        ],
-        stream=True,
-    )
-    for chunk in stream:
-        yield chunk['message']['content']
\ No newline at end of file
+        ]
+
+    def get_response(self, user_input, history=(), session=None, metrics=None, cancellation=None,
+                     offer=None):
+        # metrics, when given, is filled with the answer's timings (seconds)
+        # as it streams: ttft, duration and Ollama's own load, prefill and
+        # decode figures. cancellation (backend.endpoints.Cancellation) stops
+        # the request from another thread, the stream then raises Cancelled.
+        # offer(prompt, response) is asked whether the cached answer to a
+        # similar question should be used, without it the model is asked.
+        metrics = {} if metrics is None else metrics
+        started = time.monotonic()
+        get_metrics().increment("requests_total")
+        stream = self.lookup_response(user_input, history, session, metrics, cancellation, offer)
+        return self.measured_response(stream, metrics, started)
+
+    def lookup_response(self, user_input, history, session, metrics, cancellation=None, offer=None):
+        # A generator, so the cache lookups run on the thread that consumes
+        # the answer and their errors come out of the stream like the model's
+        if self.cache is None:
+            yield from self.stream_response(user_input, history, session, metrics, cancellation)
+            return
+        key = self.cache.key(self.model, SYSTEM_PROMPT, self.options, self.messages(user_input, history))
+        response = self.cache.get(key)
+        get_metrics().increment("cache_hits_total" if response is not None else "cache_misses_total")
+        vector = None
+        if response is None and self.semantic_cache is not None and not history:
+            # Only a session's first question stands on its own, follow-ups
+            # depend on the turns before them
+            vector = self.embed(user_input)
+            if vector is not None:
+                response = self.similar_response(vector, offer)
+                if cancellation is not None and cancellation.is_set():
+                    raise Cancelled()
+        if response is not None:
+            # The model never sees this turn, so the session's context is stale
+            with self.contexts_lock:
+                self.contexts.pop(session, None)
+            metrics["cached"] = True
+            # What the cache saves, in bytes of answer the model didn't generate
+            get_metrics().increment("cache_saved_bytes_total", len(response.encode()))
+            yield from replay(response)
+            return
+        stream = self.stream_response(user_input, history, session, metrics, cancellation)
+        yield from self.cached_response(key, stream, vector, user_input)
+
+    def similar_response(self, vector, offer):
+        # A similar question is not necessarily the same one (residential or
+        # commercial stairs), its answer is only used when offer accepts it
+        similar = self.semantic_cache.lookup(vector)
+        if similar is None:
+            return None
+        response = self.cache.get(similar)
+        if response is None:
+            return None
+        get_metrics().increment("semantic_cache_hits_total")
+        if offer is None or not offer(self.semantic_cache.prompt(similar), response):
+            return None
+        get_metrics().increment("semantic_cache_accepted_total")
+        return response
+
+    def stream_response(self, user_input, history=(), session=None, metrics=None, cancellation=None):
+        metrics = {} if metrics is None else metrics
+        if self.mode == 'generate' and session is not None:
+            return self.generate_response(user_input, history, session, metrics, cancellation)
+        return self.chat_response(user_input, history, metrics, cancellation)
+
+    def measured_response(self, stream, metrics, started):
+        first = last = None
+        completed = False
+        try:
+            for chunk in stream:
+                last = time.monotonic()
+                if first is None:
+                    first = last
+                yield chunk
+            completed = True
+        except Cancelled:
+            raise
+        except Exception:
+            get_metrics().increment("generation_errors_total")
+            raise
+        finally:
+            stream.close()
+            if first is not None:
+                metrics["ttft"] = first - started
+                metrics["duration"] = last - started
+            # Stopped answers would skew the figures
+            if completed:
+                get_metrics().record_generation(metrics)
+
+    def cached_response(self, key, stream, vector=None, prompt=None):
+        # Only answers that streamed to the end are cached, not stopped ones
+        chunks = []
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            stream.close()
+        self.cache.put(key, ''.join(chunks))
+        if vector is not None:
+            self.semantic_cache.add(vector, key, prompt)
+
+    def embed(self, text):
+        # None when the embedding model is unavailable, the question is then
+        # only looked up by its exact wording
+        try:
+            response = self.endpoints.call('embed', model=EMBED_MODEL, input=text, keep_alive=self.keep_alive,
+                                           dimensions=EMBED_DIMENSIONS)
+        except Exception:
+            return None
+        return SemanticCache.normalize(response['embeddings'][0])
+
+    def chat_response(self, user_input, history, metrics, cancellation=None):
+        stream = self.endpoints.stream(
+            'chat',
+            cancellation=cancellation,
+            model=self.model,
+            messages=self.messages(user_input, history),
+            options=self.options,
+            keep_alive=self.keep_alive,
+        )
+        try:
+            for chunk in stream:
+                yield chunk['message']['content']
+                if chunk.get('done'):
+                    metrics.update(ollama_timings(chunk))
+        finally:
+            # Closing the generator early closes the HTTP stream, which makes
+            # Ollama stop generating
+            stream.close()
+
+    def generate_response(self, user_input, history, session, metrics, cancellation=None):
+        # Continues from the session's context tokens when they cover exactly
+        # the turns in history and fit in the history budget. Otherwise (first
+        # question after launch, a stopped or cached answer, a long session)
+        # the turns that fit are replayed as text once.
+        with self.contexts_lock:
+            turns, context = self.contexts.pop(session, (None, None))
+        if turns == len(history) and len(context) <= self.history_tokens:
+            prompt = user_input
+        else:
+            prompt, context = history_prompt(user_input, history, self.history_tokens), None
+        stream = self.endpoints.stream(
+            'generate',
+            cancellation=cancellation,
+            model=self.model,
+            prompt=prompt,
+            # The context already starts with the system prompt
+            system=None if context else SYSTEM_PROMPT,
+            context=context,
+            options=self.options,
+            keep_alive=self.keep_alive,
+        )
+        try:
+            for chunk in stream:
+                yield chunk['response']
+                if chunk.get('done'):
+                    metrics.update(ollama_timings(chunk))
+                if chunk.get('done') and chunk.get('context'):
+                    with self.contexts_lock:
+                        self.contexts[session] = (len(history) + 1, chunk['context'])
+                        while len(self.contexts) > CONTEXT_SESSIONS:
+                            self.contexts.popitem(last=False)
+        finally:
+            stream.close()
+
+    def warm_up(self):
+        # An empty prompt makes Ollama load the model without generating
+        self.endpoints.call_all('generate', model=self.model, prompt='', keep_alive=self.keep_alive)
+
+    def close(self):
+        self.endpoints.close()
+        if self.semantic_cache is not None:
+            self.semantic_cache.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        cache = ResponseCache()
+        semantic_cache = SemanticCache(cache) if SEMANTIC_CACHE and numpy is not None else None
+        _client = OllamaClient(cache=cache, semantic_cache=semantic_cache)
+        if RECORD_PATH:
+            _client.endpoints = RecordingEndpoints(_client.endpoints, RECORD_PATH)
+    return _client
+
+
+def set_client(client):
+    # Makes get_response() use another client, e.g. one replaying recordings
+    global _client
+    _client = client
+
+
+def get_response(user_input, history=(), session=None, metrics=None, cancellation=None, offer=None):
+    return get_client().get_response(user_input, history, session, metrics, cancellation, offer)
+
+
+def warm_up():
+    get_client().warm_up()
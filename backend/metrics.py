@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Recent samples kept per histogram, percentiles are taken over these
+HISTOGRAM_SAMPLES = 1024
+# Port of the Prometheus text endpoint on localhost, None keeps it off
+METRICS_PORT = None
+METRICS_PREFIX = "ollama_ui_"
+QUANTILES = (0.5, 0.95)
+
+# Durations Ollama reports in nanoseconds with the last chunk of an answer
+OLLAMA_DURATIONS = ("load_duration", "prompt_eval_duration", "eval_duration", "total_duration")
+OLLAMA_COUNTS = ("prompt_eval_count", "eval_count")
+
+
+class Histogram:
+    def __init__(self, samples=HISTOGRAM_SAMPLES):
+        self.samples = deque(maxlen=samples)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class MetricsRegistry:
+    # Counters, gauges and histograms by name, updated from any thread
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def record_generation(self, metrics):
+        self.increment("generations_total")
+        if metrics.get("cached"):
+            # Replayed from the cache, its timings would hide the model's
+            self.increment("generations_cached_total")
+            return
+        for name, metric in (("ttft", "generation_ttft_seconds"),
+                             ("duration", "generation_duration_seconds"),
+                             ("prompt_eval_duration", "generation_prefill_seconds"),
+                             ("load_duration", "generation_load_seconds"),
+                             ("tokens_per_second", "generation_tokens_per_second")):
+            if metrics.get(name) is not None:
+                self.observe(metric, metrics[name])
+
+    def render(self):
+        # Prometheus text format, histograms as summaries over recent samples
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} counter")
+                lines.append(f"{METRICS_PREFIX}{name} {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} gauge")
+                lines.append(f"{METRICS_PREFIX}{name} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} summary")
+                for quantile in QUANTILES:
+                    lines.append(f'{METRICS_PREFIX}{name}{{quantile="{quantile}"}} '
+                                 f'{histogram.percentile(quantile)}')
+                lines.append(f"{METRICS_PREFIX}{name}_sum {histogram.sum}")
+                lines.append(f"{METRICS_PREFIX}{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = get_metrics().render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port=METRICS_PORT):
+    # Serves /metrics on localhost from a daemon thread
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+@contextmanager
+def timed(name):
+    # Observes how long the block took, in seconds
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_metrics().observe(name, time.perf_counter() - started)
+
+
+def ollama_timings(chunk):
+    # Ollama's own accounting from the final chunk, durations in seconds
+    timings = {}
+    for name in OLLAMA_DURATIONS:
+        if chunk.get(name) is not None:
+            timings[name] = chunk[name] / 1e9
+    for name in OLLAMA_COUNTS:
+        if chunk.get(name) is not None:
+            timings[name] = chunk[name]
+    if timings.get("eval_count") and timings.get("eval_duration"):
+        timings["tokens_per_second"] = timings["eval_count"] / timings["eval_duration"]
+    return timings
+
+
+_metrics = None
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = MetricsRegistry()
+    return _metrics
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import random
+import threading
+import time
+
+from backend.endpoints import Cancelled
+
+# Used for synthetic answers when there is no recording to replay
+SYNTHETIC_WORDS = ["the", "fire", "code", "requires", "staircases", "to", "be", "enclosed", "clause",
+                   "4.2", "of", "building", "control", "regulations", "minimum", "width", "exit"]
+
+
+def request_key(method, kwargs):
+    # What identifies a recorded answer: the model and what it was asked
+    request = {"method": method, "model": kwargs.get("model"),
+               "messages": kwargs.get("messages"), "prompt": kwargs.get("prompt")}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+def chunk_data(chunk):
+    # Ollama's chunks are pydantic models, fixtures store them as plain dicts
+    if hasattr(chunk, "model_dump"):
+        return chunk.model_dump(mode="json", exclude_none=True)
+    return dict(chunk)
+
+
+def load_recordings(path):
+    # A fixture file holds one recorded stream per line
+    recordings = []
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                recordings.append(json.loads(line))
+    return recordings
+
+
+def synthetic_recording(tokens=500, seed=0):
+    # A chat answer of the given length with no timing of its own
+    rng = random.Random(seed)
+    chunks = [{"chunk": {"message": {"role": "assistant", "content": " " + rng.choice(SYNTHETIC_WORDS)},
+                         "response": "", "done": False}}
+              for _ in range(tokens)]
+    chunks.append({"chunk": {"message": {"role": "assistant", "content": ""}, "response": "",
+                             "done": True, "eval_count": tokens}})
+    return {"method": "chat", "key": None, "chunks": chunks}
+
+
+class ReplayEndpoints:
+    # Stands in for an EndpointPool: streams answers from recordings instead of
+    # Ollama, with the recorded gaps between chunks, or at tokens_per_second
+    # after the recorded (or given) time to first token. A request gets the
+    # recording made for the same question if there is one, otherwise the
+    # recordings are used in turn.
+    def __init__(self, recordings, tokens_per_second=None, ttft=None):
+        self.recordings = recordings
+        self.by_key = {recording["key"]: recording for recording in recordings if recording.get("key")}
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft
+        self.next = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        return cls(load_recordings(path), **kwargs)
+
+    def recording(self, method, kwargs):
+        with self.lock:
+            recording = self.by_key.get(request_key(method, kwargs))
+            if recording is None:
+                recording = self.recordings[self.next % len(self.recordings)]
+                self.next += 1
+            return recording
+
+    def schedule(self, chunks):
+        # Seconds after the request at which each chunk is due
+        first = self.ttft if self.ttft is not None else chunks[0].get("t", 0.0)
+        if self.tokens_per_second:
+            return [first + index / self.tokens_per_second for index in range(len(chunks))]
+        offset = first - chunks[0].get("t", 0.0)
+        return [entry.get("t", 0.0) + offset for entry in chunks]
+
+    def stream(self, method, cancellation=None, **kwargs):
+        recording = self.recording(method, kwargs)
+        chunks = recording["chunks"]
+        started = time.monotonic()
+        for entry, due in zip(chunks, self.schedule(chunks)):
+            delay = started + due - time.monotonic()
+            if delay > 0:
+                if cancellation is None:
+                    time.sleep(delay)
+                elif cancellation.wait(delay):
+                    raise Cancelled()
+            yield self.convert(entry["chunk"], recording["method"], method)
+
+    @staticmethod
+    def convert(chunk, recorded, method):
+        # A chat recording can answer a generate request and the other way round
+        chunk = dict(chunk)
+        if recorded == "chat" and method == "generate":
+            chunk["response"] = chunk.get("message", {}).get("content", "")
+        elif recorded == "generate" and method == "chat":
+            chunk["message"] = {"role": "assistant", "content": chunk.get("response", "")}
+        return chunk
+
+    def call(self, method, **kwargs):
+        raise RuntimeError(f"{method} is not recorded")
+
+    def call_all(self, method, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingEndpoints:
+    # Wraps a real EndpointPool and appends every answer that streams to the
+    # end, with its chunk timings, to a fixture file for ReplayEndpoints
+    def __init__(self, endpoints, path):
+        self.endpoints = endpoints
+        self.path = path
+        self.lock = threading.Lock()
+
+    def stream(self, method, cancellation=None, **kwargs):
+        chunks = []
+        started = time.monotonic()
+        for chunk in self.endpoints.stream(method, cancellation, **kwargs):
+            chunks.append({"t": time.monotonic() - started, "chunk": chunk_data(chunk)})
+            yield chunk
+        recording = {"method": method, "key": request_key(method, kwargs), "chunks": chunks}
+        with self.lock, open(self.path, 'a') as file:
+            file.write(json.dumps(recording) + "\n")
+
+    def call(self, method, **kwargs):
+        return self.endpoints.call(method, **kwargs)
+
+    def call_all(self, method, **kwargs):
+        return self.endpoints.call_all(method, **kwargs)
+
+    def close(self):
+        self.endpoints.close()
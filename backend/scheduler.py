@@ -0,0 +1,60 @@
+from collections import deque
+
+from PySide6.QtCore import QObject, QThreadPool, Signal
+
+# Sessions that may generate at the same time, questions within one session
+# always run one after another
+MAX_CONCURRENT_SESSIONS = 2
+
+
+class GenerationScheduler(QObject):
+    # Queues response workers per session and starts them on a bounded pool.
+    # Lives on the GUI thread; done() must be called when a worker's answer
+    # has been handled so the next question can start.
+    queue_changed = Signal()
+
+    def __init__(self, max_sessions=MAX_CONCURRENT_SESSIONS, parent=None):
+        super().__init__(parent)
+        self.max_sessions = max_sessions
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max_sessions)
+        self.waiting = deque()  # (session, worker, prepare) in submission order
+        self.running = {}  # session -> worker
+
+    def submit(self, session, worker, prepare=None):
+        # prepare(worker) runs right before the worker starts, when the
+        # earlier answers of its session are complete
+        self.waiting.append((session, worker, prepare))
+        self.dispatch()
+
+    def dispatch(self):
+        for entry in list(self.waiting):
+            if len(self.running) >= self.max_sessions:
+                break
+            session, worker, prepare = entry
+            if session in self.running:
+                continue
+            self.waiting.remove(entry)
+            self.running[session] = worker
+            if prepare is not None:
+                prepare(worker)
+            self.thread_pool.start(worker)
+        self.queue_changed.emit()
+
+    def position(self, worker):
+        # 1-based place in the waiting line, None when running or finished
+        for position, (session, waiting, prepare) in enumerate(self.waiting, 1):
+            if waiting is worker:
+                return position
+        return None
+
+    def done(self, worker):
+        # Also drops a worker that was still waiting
+        for entry in self.waiting:
+            if entry[1] is worker:
+                self.waiting.remove(entry)
+                break
+        for session, running in list(self.running.items()):
+            if running is worker:
+                del self.running[session]
+        self.dispatch()
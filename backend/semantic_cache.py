@@ -0,0 +1,116 @@
+import os
+
+try:
+    import numpy
+except ImportError:  # the semantic cache is optional
+    numpy = None
+
+SEMANTIC_CACHE = False
+EMBED_MODEL = 'nomic-embed-text'
+# Truncated embedding size for models that support it, lookup cost grows with it
+EMBED_DIMENSIONS = None
+# Cosine similarity from which a prompt counts as the same question
+SIMILARITY_THRESHOLD = 0.92
+# Prompts remembered, the oldest one is overwritten after that
+SEMANTIC_MAX_ENTRIES = 100_000
+VECTORS_PATH = "response_cache.vectors.npy"
+
+
+class SemanticCache:
+    # Maps prompts that are worded differently but mean the same to a key of
+    # a ResponseCache, whose database also holds the row -> key table.
+    # Unit-length prompt embeddings are rows of a memory-mapped matrix, a
+    # lookup is one matrix-vector product.
+    def __init__(self, cache, path=VECTORS_PATH, threshold=SIMILARITY_THRESHOLD,
+                 max_entries=SEMANTIC_MAX_ENTRIES):
+        if numpy is None:
+            raise RuntimeError("The semantic cache needs numpy")
+        self.connection = cache.connection
+        self.lock = cache.lock
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS prompt_vectors (
+                    row INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    prompt TEXT
+                )""")
+            self.vectors = None
+            if os.path.exists(path):
+                self.vectors = numpy.load(path, mmap_mode='r+')
+            else:
+                # The vectors are gone, so are the prompts they stood for
+                self.connection.execute("DELETE FROM prompt_vectors")
+            rows = self.connection.execute("SELECT row, key, seq FROM prompt_vectors").fetchall()
+        self.keys = [None] * (len(self.vectors) if self.vectors is not None else 0)
+        for row, key, seq in rows:
+            if row < len(self.keys):
+                self.keys[row] = key
+        self.count = sum(1 for key in self.keys if key is not None)
+        self.seq = max((seq for row, key, seq in rows), default=0)
+
+    def lookup(self, vector):
+        # The cache key of the most similar earlier prompt, if it is close enough
+        with self.lock:
+            if not self.count or len(vector) != self.vectors.shape[1]:
+                return None
+            scores = self.vectors[:self.count] @ vector
+            row = int(scores.argmax())
+            if scores[row] < self.threshold:
+                return None
+            return self.keys[row]
+
+    def prompt(self, key):
+        # The question that was asked when the answer under key was cached
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT prompt FROM prompt_vectors WHERE key = ? LIMIT 1", (key,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, vector, key, prompt=None):
+        with self.lock, self.connection:
+            if self.vectors is not None and len(vector) != self.vectors.shape[1]:
+                return  # a different embedding model, keep the existing vectors
+            if self.count < self.max_entries:
+                row = self.count
+                self.reserve(row + 1, len(vector))
+                self.count += 1
+            else:
+                row = self.connection.execute(
+                    "SELECT row FROM prompt_vectors ORDER BY seq LIMIT 1").fetchone()[0]
+            self.vectors[row] = vector
+            self.keys[row] = key
+            self.seq += 1
+            self.connection.execute(
+                "INSERT OR REPLACE INTO prompt_vectors (row, key, seq, prompt) VALUES (?, ?, ?, ?)",
+                (row, key, self.seq, prompt))
+
+    def reserve(self, rows, dimensions):
+        # Grows the file by doubling, rows past self.count are unused
+        if self.vectors is not None and len(self.vectors) >= rows:
+            return
+        capacity = min(self.max_entries, max(1024, 2 * rows))
+        vectors = numpy.lib.format.open_memmap(
+            self.path + ".tmp", mode='w+', dtype=numpy.float32, shape=(capacity, dimensions))
+        if self.vectors is not None:
+            vectors[:self.count] = self.vectors[:self.count]
+        vectors.flush()
+        del vectors
+        self.vectors = None
+        os.replace(self.path + ".tmp", self.path)
+        self.vectors = numpy.load(self.path, mmap_mode='r+')
+        self.keys.extend([None] * (capacity - len(self.keys)))
+
+    @staticmethod
+    def normalize(embedding):
+        vector = numpy.asarray(embedding, dtype=numpy.float32)
+        return vector / max(float(numpy.linalg.norm(vector)), 1e-12)
+
+    def close(self):
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+                self.vectors = None
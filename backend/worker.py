@@ -0,0 +1,86 @@
+import threading
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+from backend.endpoints import Cancellation, Cancelled
+from backend.main import get_response, warm_up
+
+
+class WorkerSignals(QObject):
+    # Signals live on the GUI thread, so emits from the pool thread are queued
+    chunk = Signal(str)
+    finished = Signal(str)
+    error = Signal(str)
+    # The earlier question whose answer is offered for this one, see decide()
+    similar = Signal(str)
+
+
+class ResponseWorker(QRunnable):
+    def __init__(self, user_input, history=(), session=None):
+        super().__init__()
+        self.user_input = user_input
+        # Earlier prompt/response pairs of the session, a copy owned by the worker
+        self.history = list(history)
+        self.session = session
+        # Filled with the answer's timings while it streams, read after finished
+        self.metrics = {}
+        # The error that ended the answer, read after finished
+        self.error = None
+        self.signals = WorkerSignals()
+        self.cancellation = Cancellation()
+        self.decided = threading.Event()
+        self.use_cached = False
+
+    def cancel(self):
+        # Safe from any thread, the HTTP stream is closed right away, also
+        # while Ollama is still loading the model or reading the prompt
+        self.cancellation.cancel()
+        self.decided.set()
+
+    def decide(self, use_cached):
+        # The user's answer to the similar signal, from any thread
+        self.use_cached = use_cached
+        self.decided.set()
+
+    def offer(self, prompt, response):
+        # Called on the pool thread, which waits for the user to decide
+        self.signals.similar.emit(prompt or "")
+        self.decided.wait()
+        return self.use_cached
+
+    def run(self):
+        # Runs on a pool thread, the network stream never touches the GUI thread
+        response = []
+        stream = None
+        try:
+            stream = get_response(self.user_input, self.history, self.session, self.metrics,
+                                  self.cancellation, self.offer)
+            for chunk in stream:
+                if self.cancellation.is_set():
+                    break
+                response.append(chunk)
+                self.signals.chunk.emit(chunk)
+        except Cancelled:
+            pass
+        except Exception as error:
+            self.error = str(error)
+            self.signals.error.emit(self.error)
+        finally:
+            if stream is not None:
+                stream.close()
+        self.signals.finished.emit(''.join(response))
+
+
+class WarmUpWorker(QRunnable):
+    # Loads the model in the background so the first question doesn't wait for it
+    def __init__(self):
+        super().__init__()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            warm_up()
+        except Exception as error:
+            self.signals.error.emit(str(error))
+            return
+        self.signals.finished.emit('')
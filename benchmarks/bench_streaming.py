@@ -0,0 +1,82 @@
+# Per-chunk cost of streaming a long answer into the chat transcript.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/bench_streaming.py [--tokens 20000] [--history 0]
+#
+# Streams chunks into a response row of a TranscriptView, letting the view
+# repaint after every chunk, and prints the mean cost per chunk for each slice of the
+# answer. A flat row means the cost per chunk does not grow with the answer
+# length. --history puts that many earlier turns in front of the answer.
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtCore import qInstallMessageHandler
+from PySide6.QtWidgets import QApplication
+
+from components.transcript import TranscriptView
+
+WORDS = ["the", "fire", "code", "requires", "staircases", "to", "be", "enclosed", "clause",
+         "4.2", "of", "building", "control", "regulations", "minimum", "width", "exit"]
+
+
+def quiet(mode, context, message):
+    pass
+
+
+def make_chunks(count, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    for i in range(count):
+        chunk = " " + rng.choice(WORDS)
+        if i % 60 == 59:
+            chunk += "\n\n"
+        chunks.append(chunk)
+    return chunks
+
+
+def run(app, chunks, slices, width, history):
+    view = TranscriptView()
+    view.resize(width, 600)
+    view.show()
+    view.set_messages([{"prompt": "question %d" % i, "response": "answer %d" % i}
+                       for i in range(history)])
+    view.append_message("prompt", "what is the fire code for stairs")
+    response = view.append_message("response")
+    app.processEvents()
+
+    per_slice = len(chunks) // slices
+    timings = []
+    for start in range(0, per_slice * slices, per_slice):
+        begin = time.perf_counter()
+        for chunk in chunks[start:start + per_slice]:
+            view.append_text(response, chunk)
+            app.processEvents()
+        timings.append((time.perf_counter() - begin) / per_slice * 1e6)
+    view.deleteLater()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--slices", type=int, default=10)
+    parser.add_argument("--width", type=int, default=500)
+    parser.add_argument("--history", type=int, default=0)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    qInstallMessageHandler(quiet)  # offscreen platform warnings
+    chunks = make_chunks(args.tokens)
+
+    print(f"{args.tokens} chunks, mean microseconds per chunk per {100 // args.slices}% of the answer")
+    timings = run(app, chunks, args.slices, args.width, args.history)
+    print("  append: " + " ".join(f"{t:8.1f}" for t in timings), flush=True)
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
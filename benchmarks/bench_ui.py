@@ -0,0 +1,212 @@
+# Headless benchmarks of the hot UI paths, results go to a JSON file.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/bench_ui.py [--output bench_results.json]
+#
+# Runs in a temporary directory with its own history and response cache, and
+# answers come from backend.replay instead of Ollama. Measures:
+#   change_page       ChatWidget.changePage for sessions of --turns turns,
+#                     cold (read from the history) and warm, including layout and paint
+#   streaming         mean microseconds per chunk appended to the transcript,
+#                     and per chunk through the whole worker/buffer pipeline
+#   sidebar           Sidebar.updateHistoryWidget for --sessions sessions after --changes
+#                     sessions were added, renamed and deleted behind its back
+#   window            constructing main.Window
+#   peak_rss_kib, widgets
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PySide6.QtCore import qInstallMessageHandler
+from PySide6.QtWidgets import QApplication
+
+from backend.history import ChatHistoryStore, SqliteHistoryBackend, set_store
+from backend.main import OllamaClient, set_client
+from backend.replay import ReplayEndpoints, synthetic_recording
+from components.chat_widget import ChatWidget
+from components.sidebar import Sidebar
+from main import Window
+from bench_streaming import make_chunks, run as run_streaming
+
+RESPONSE = "The staircase must be enclosed in accordance with clause 4.2 of the regulations. " * 4
+
+
+def quiet(mode, context, message):
+    pass
+
+
+def fill_session(store, turns):
+    session = store.create_session("bench")
+    for turn in range(turns):
+        store.add_message(session["chat_id"], f"question {turn} about fire escapes", RESPONSE)
+    store.flush()
+    return session["chat_id"]
+
+
+def bench_change_page(app, store, turns_list, repeat):
+    widget = ChatWidget(store)
+    widget.resize(600, 800)
+    widget.show()
+    results = {}
+    for turns in turns_list:
+        chat_id = fill_session(store, turns)
+        store.contents.clear()  # the first open reads from the history
+        timings = []
+        for _ in range(repeat + 1):
+            begin = time.perf_counter()
+            widget.changePage(chat_id)
+            app.processEvents()
+            timings.append((time.perf_counter() - begin) * 1000)
+        results[str(turns)] = {"cold_ms": timings[0], "warm_ms": min(timings[1:])}
+        print(f"  changePage {turns:>5} turns: cold {timings[0]:7.1f} ms, warm {min(timings[1:]):7.1f} ms",
+              flush=True)
+    widget.close()
+    widget.deleteLater()
+    return results
+
+
+def bench_pipeline(app, store, tokens):
+    # Chunks as fast as the worker can produce them, through signals, the
+    # chunk buffer and the transcript
+    set_client(OllamaClient(mode='chat', endpoints=ReplayEndpoints([synthetic_recording(tokens)])))
+    widget = ChatWidget(store)
+    widget.resize(600, 800)
+    widget.show()
+    widget.changePage(store.create_session("stream")["chat_id"])
+    widget.layout.itemAt(1).widget().layout().itemAt(0).widget().setText("what is the fire code for stairs")
+    begin = time.perf_counter()
+    widget.submit_button_clicked()
+    while widget.generations:
+        app.processEvents()
+    elapsed = time.perf_counter() - begin
+    widget.close()
+    widget.deleteLater()
+    return elapsed / tokens * 1e6
+
+
+def bench_sidebar(app, directory, sessions, changes, repeat):
+    store = ChatHistoryStore(open_backend_in(directory, "sidebar"))
+    for index in range(sessions):
+        store.create_session(f"session {index}")
+    store.flush()
+    sidebar = Sidebar(store)
+    sidebar.show()
+    app.processEvents()
+    # The rows only learn about the changes below from updateHistoryWidget,
+    # as after another process changed the history
+    store.unsubscribe(sidebar.history_model.on_history_changed)
+    timings = []
+    for _ in range(repeat):
+        chat_ids = [session["chat_id"] for session in store.sessions]
+        step = max(1, len(chat_ids) // changes)
+        for chat_id in chat_ids[::step][:changes]:
+            store.delete_session(chat_id)
+        for chat_id in chat_ids[step // 2::step][:changes]:
+            store.rename_session(chat_id, f"renamed {chat_id}")
+        for index in range(changes):
+            store.create_session(f"new session {index}")
+        begin = time.perf_counter()
+        sidebar.updateHistoryWidget()
+        app.processEvents()
+        timings.append((time.perf_counter() - begin) * 1000)
+    sidebar.close()
+    sidebar.deleteLater()
+    store.close()
+    return {"sessions": sessions, "changes": changes, "update_ms": min(timings)}
+
+
+def bench_window(app):
+    begin = time.perf_counter()
+    window = Window()
+    window.show()
+    app.processEvents()
+    elapsed = (time.perf_counter() - begin) * 1000
+    widgets = len(QApplication.allWidgets())
+    window.close()
+    # Window opened the default history in the temporary directory, which
+    # can't be removed on Windows while the database is open
+    window.store.close()
+    set_store(None)
+    return {"construct_ms": elapsed, "widgets": widgets}
+
+
+def peak_rss_kib():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS
+    if psutil is not None:
+        return psutil.Process().memory_info().peak_wset // 1024
+    return None
+
+
+def open_backend_in(directory, name):
+    return SqliteHistoryBackend(os.path.join(directory, name + ".db"), json_path=None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--changes", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    qInstallMessageHandler(quiet)  # offscreen platform warnings
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app's history and caches are created relative to the working directory
+        os.chdir(directory)
+        store = ChatHistoryStore(open_backend_in(directory, "history"))
+        results = {"platform": QApplication.platformName()}
+
+        print("changePage")
+        results["change_page"] = bench_change_page(app, store, args.turns, args.repeat)
+
+        print("streaming")
+        append = run_streaming(app, make_chunks(args.tokens), 10, 500, 0)
+        pipeline = bench_pipeline(app, store, args.tokens)
+        results["streaming"] = {"tokens": args.tokens, "append_us_per_chunk": append,
+                                "pipeline_us_per_chunk": pipeline}
+        print(f"  append us/chunk per 10%: " + " ".join(f"{t:.1f}" for t in append))
+        print(f"  pipeline: {pipeline:.1f} us/chunk", flush=True)
+
+        print("sidebar")
+        results["sidebar"] = bench_sidebar(app, directory, args.sessions, args.changes, args.repeat)
+        print(f"  updateHistoryWidget, {args.sessions} sessions, {args.changes} added, renamed and deleted: "
+              f"{results['sidebar']['update_ms']:.1f} ms")
+
+        print("window")
+        results["window"] = bench_window(app)
+        print(f"  Window(): {results['window']['construct_ms']:.1f} ms, "
+              f"{results['window']['widgets']} widgets", flush=True)
+
+        store.close()
+        results["widgets"] = len(QApplication.allWidgets())
+        results["peak_rss_kib"] = peak_rss_kib()
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        os.chdir(os.path.dirname(output))
+
+    print(f"peak RSS {results['peak_rss_kib']} KiB, results in {output}")
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
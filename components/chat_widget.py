@@ -1,131 +1,114 @@
-import json
 import rc_icons
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QThreadPool, QTimer, Signal
 from PySide6.QtGui import QIcon
-from PySide6.QtWidgets import QLineEdit, QPushButton, QHBoxLayout
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QScrollArea, QApplication, QSizePolicy, \
-    QTextEdit
-
-from backend.main import get_response
-
-class GrowingTextEdit(QTextEdit):
-    def __init__(self, *args, **kwargs):
-        super(GrowingTextEdit, self).__init__(*args, **kwargs)
-        self.setObjectName('main-label')
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)  # Set the size policy to expand
-        self.setReadOnly(True)
-
-    def resizeEvent(self, event):
-        super(GrowingTextEdit, self).resizeEvent(event)
-        contents_height = self.document().size().height()
-        self.setFixedHeight(contents_height)  # Adjust the height based on the contents and add padding
-
-def clear_layout(layout):
-    while layout.count():
-        child = layout.takeAt(0)
-        if child.widget():
-            child.widget().deleteLater()
-
-def save_chat_history(chat_history):
-    with open('chat_history.json', 'w') as file:
-        json.dump(chat_history, file, indent=4)
-
-def get_chat_history():
-    try:
-        with open('chat_history.json', 'r') as file:
-            chat_history = json.load(file)
-    except FileNotFoundError:
-        chat_history = []
-    return chat_history
-
-def update_chat_history(prompt, response):
-    chat_history = get_chat_history()
-    if not chat_history or 'content' not in chat_history[-1]:
-        chat_history.append({"chat_id": len(chat_history) + 1, "message": prompt, "content": []})
-    elif not chat_history[-1]['content']:
-        chat_history[-1]['message'] = prompt
-    # Append the prompt and response as a dictionary to the 'content' list of the last chat
-    chat_history[-1]['content'].append({"prompt": prompt, "response": response})
-    save_chat_history(chat_history)
+from PySide6.QtWidgets import QLabel, QLineEdit, QPushButton, QHBoxLayout
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QSizePolicy
+
+from backend.history import get_store
+from backend.main import MODEL
+from backend.metrics import get_metrics, timed
+from backend.scheduler import GenerationScheduler, MAX_CONCURRENT_SESSIONS
+from backend.worker import ResponseWorker, WarmUpWorker
+from components.chunk_buffer import ChunkBuffer, FRAME_INTERVAL_MS
+from components.dev_tools import profiled
+from components.transcript import TranscriptView
+
+# How long "model ready" stays visible after the warm-up
+STATUS_TIMEOUT_MS = 3000
+# Show first-token time and tokens/s under each response
+SHOW_METRICS = False
 
 class ChatWidget(QWidget):
-    def __init__(self):
+    # From the history writer thread, queued to the GUI thread
+    history_error = Signal(str)
+
+    def __init__(self, store=None, flush_interval=FRAME_INTERVAL_MS, max_sessions=MAX_CONCURRENT_SESSIONS,
+                 show_metrics=SHOW_METRICS):
         super().__init__()
+        self.store = store or get_store()
+        self.chat_id = None
+        self.flush_interval = flush_interval
         self.layout = QVBoxLayout()
         self.setObjectName('chat-widget')
         self.setMinimumWidth(500)
         self.setLayout(self.layout)
 
-        self.response_widget = QWidget()
-        self.response_widget.setObjectName('main-chat-widget')
-        self.response_layout = QVBoxLayout()
-        # set alignment to top
-        self.response_layout.setAlignment(Qt.Alignment.AlignTop)
-        self.response_widget.setLayout(self.response_layout)
-
-        # Create a QScrollArea and set the response_widget as its widget
-        self.response_scroll_area = QScrollArea()
-        self.response_scroll_area.setWidgetResizable(True)
-        self.response_scroll_area.setWidget(self.response_widget)
-
-        # Add the QScrollArea to the layout instead of the response_widget
-        self.layout.addWidget(self.response_scroll_area)  # Add stretch factor to response_widget
+        # Messages are rows of a model, only the visible ones are laid out and painted
+        self.transcript = TranscriptView(show_metrics=show_metrics)
+        self.layout.addWidget(self.transcript)
         self.input_widget = self.input_widget()
         self.input_widget.setEnabled(False)
 
-    def changePage(self, chat_widget):
-        chat_widget_data = json.loads(chat_widget)
-        clear_layout(self.response_layout)
-        for item in chat_widget_data['content']:
-            self.prompt_widget(item['prompt'])
-            self.response_widget_method(item["response"])
-        self.input_widget.setEnabled(True)
-
-    def prompt_widget(self, prompt):
-        prompt_layout = QHBoxLayout()
-        prompt_layout.setContentsMargins(0, 0, 0, 0)
-        prompt_icon = QLabel()
-        icon = QIcon(':/icons/user_icon.svg')  # Create QIcon from the SVG file
-        pixmap = icon.pixmap(20, 20)  # Create QPixmap from QIcon
-        prompt_icon.setPixmap(pixmap)  # Set QPixmap as the icon for QLabel
-        prompt_icon.setFixedSize(20, 20)  # Set a fixed size for the icon
-
-        prompt_label = GrowingTextEdit(prompt)
-        prompt_label.setObjectName('prompt-label')
-        prompt_label.setReadOnly(True)
-
-        prompt_layout.addWidget(prompt_icon)
-        prompt_layout.addWidget(prompt_label)
-        prompt_layout.setAlignment(Qt.AlignTop)
-        prompt_layout.setAlignment(prompt_icon, Qt.AlignTop)
-        prompt_widget = QWidget()
-        prompt_widget.setObjectName('prompt-widget')
-        prompt_widget.setLayout(prompt_layout)
-        self.response_layout.addWidget(prompt_widget)
-
-        self.response_layout.setAlignment(prompt_widget, Qt.AlignTop)
-
-    def response_widget_method(self, response):
-        response_layout = QHBoxLayout()
-        response_layout.setContentsMargins(0, 0, 0, 0)
-        response_icon = QLabel()
-        icon = QIcon(':/icons/ai_icon.png')  # Create QIcon from the SVG file
-        pixmap = icon.pixmap(20, 20)  # Create QPixmap from QIcon
-        response_icon.setPixmap(pixmap)  # Set QPixmap as the icon for QLabel
-        response_icon.setFixedSize(20, 20)  # Set a fixed size for the icon
-        response_label = GrowingTextEdit(response)
-        response_label.setObjectName('response-label')
-        response_label.setReadOnly(True)
-        response_layout.addWidget(response_icon)
-        response_layout.addWidget(response_label)  # Set a stretch factor for the response
-        response_layout.setAlignment(Qt.AlignTop)  # Align the layout to the top
-        response_layout.setAlignment(response_icon, Qt.AlignTop)
-        response_widget = QWidget()
-        response_widget.setObjectName('response-widget')
-        response_widget.setLayout(response_layout)
-        self.response_layout.addWidget(response_widget)
-        self.response_layout.setAlignment(response_widget, Qt.AlignTop)
+        self.status_label = QLabel()
+        self.status_label.setObjectName('status-label')
+        self.status_label.hide()
+        self.layout.addWidget(self.status_label)
+        self.status_timer = QTimer(self)
+        self.status_timer.setSingleShot(True)
+        self.status_timer.timeout.connect(self.status_label.hide)
+        # Changes that can't be written are retried, the user should still know
+        self.history_error.connect(lambda error: self.set_status(f"Could not save the chat history: {error}"))
+        self.store.subscribe_errors(lambda error: self.history_error.emit(str(error)))
+
+        # Offers the cached answer to a similar earlier question
+        self.offer_bar = self.offer_bar()
+        # Workers waiting for the user to take or refuse a cached answer,
+        # with the question it answered
+        self.offers = {}
+
+        # Generations stream on pool threads and report back through queued
+        # signals. Questions wait their turn per session in the scheduler.
+        self.scheduler = GenerationScheduler(max_sessions, self)
+        self.scheduler.queue_changed.connect(self.show_queue_position)
+        self.thread_pool = self.scheduler.thread_pool
+        # The warm-up has its own thread, on the scheduler's pool it would
+        # hold back a session the scheduler counts as running
+        self.warm_up_pool = QThreadPool(self)
+        self.warm_up_pool.setMaxThreadCount(1)
+        self.queue_status = False
+        self.workers = set()
+        # Response workers still streaming or queued, with the callback that
+        # completes them and their prompt and response items
+        self.generations = {}
+
+    def changePage(self, chat_id):
+        # Only the opened session's transcript is read from the history
+        with timed("chat_change_page_seconds"), profiled("changePage"):
+            self.chat_id = chat_id
+            self.transcript.set_messages(self.store.get_content(chat_id))
+            # Questions of this session that are not in the history yet
+            for worker, (finish, prompt, response) in self.generations.items():
+                if worker.session == chat_id:
+                    self.transcript.append_item(prompt)
+                    self.transcript.append_item(response)
+            self.input_widget.setEnabled(True)
+            self.update_stop_button()
+            self.show_queue_position()
+            self.show_offer()
+        get_metrics().set("chat_transcript_rows", self.transcript.transcript.rowCount())
+
+    def set_status(self, text, timeout=0):
+        self.status_label.setText(text)
+        self.status_label.show()
+        if timeout:
+            self.status_timer.start(timeout)
+        else:
+            self.status_timer.stop()
+
+    def warm_up(self):
+        # Loads the model while the user reads, the window stays responsive
+        self.set_status(f"Loading {MODEL}...")
+        worker = WarmUpWorker()
+        worker.signals.finished.connect(
+            lambda text: self.warm_up_finished(worker, f"{MODEL} is ready", STATUS_TIMEOUT_MS))
+        worker.signals.error.connect(
+            lambda error: self.warm_up_finished(worker, f"Could not load {MODEL}: {error}"))
+        self.workers.add(worker)
+        self.warm_up_pool.start(worker)
+
+    def warm_up_finished(self, worker, status, timeout=0):
+        self.workers.discard(worker)
+        self.set_status(status, timeout)
 
     def input_widget(self):
         input_widget = QWidget()
@@ -145,8 +128,17 @@ class ChatWidget(QWidget):
         submit_button.setCursor(Qt.PointingHandCursor)
 
         submit_button.clicked.connect(self.submit_button_clicked)
+
+        # Shown while an answer is streaming
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setObjectName('stop-button')
+        self.stop_button.setCursor(Qt.PointingHandCursor)
+        self.stop_button.clicked.connect(self.stop_generation)
+        self.stop_button.hide()
+
         input_layout.addWidget(input_field)
         input_layout.addWidget(submit_button)
+        input_layout.addWidget(self.stop_button)
         input_widget.setLayout(input_layout)
         input_widget.setContentsMargins(0, 0, 0, 0)
         input_widget.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Maximum)
@@ -154,74 +146,169 @@ class ChatWidget(QWidget):
         input_widget.setObjectName('input-widget')
         return input_widget
 
+    def offer_bar(self):
+        offer_bar = QWidget()
+        offer_bar.setObjectName('offer-bar')
+        offer_layout = QHBoxLayout()
+        offer_layout.setContentsMargins(0, 0, 0, 0)
+        self.offer_label = QLabel()
+        self.offer_label.setObjectName('offer-label')
+        self.offer_label.setWordWrap(True)
+        use_button = QPushButton("Use cached answer")
+        use_button.setObjectName('offer-button')
+        use_button.setCursor(Qt.PointingHandCursor)
+        use_button.clicked.connect(lambda: self.decide_offer(True))
+        ask_button = QPushButton("Ask the model")
+        ask_button.setObjectName('offer-button')
+        ask_button.setCursor(Qt.PointingHandCursor)
+        ask_button.clicked.connect(lambda: self.decide_offer(False))
+        offer_layout.addWidget(self.offer_label, 1)
+        offer_layout.addWidget(use_button)
+        offer_layout.addWidget(ask_button)
+        offer_bar.setLayout(offer_layout)
+        offer_bar.hide()
+        self.layout.addWidget(offer_bar)
+        return offer_bar
+
     def get_input(self):
         input_widget = self.layout.itemAt(1).widget()
         input_field = input_widget.layout().itemAt(0).widget()
         return input_field.text().strip()
 
     def submit_button_clicked(self):
+        with profiled("submit"):
+            self.submit()
+
+    def submit(self):
         input_text = self.get_input()
         # Clear input immediately after getting the text
         self.clear_input()
 
-        # Add a new prompt label with the text from the input field
-        prompt_layout = QHBoxLayout()
-        prompt_layout.setContentsMargins(0, 0, 0, 0)
-        prompt_icon = QLabel()
-        icon = QIcon(':/icons/user_icon.svg')  # Create QIcon from the SVG file
-        pixmap = icon.pixmap(20, 20)  # Create QPixmap from QIcon
-        prompt_icon.setPixmap(pixmap)  # Set QPixmap as the icon for QLabel
-        prompt_icon.setFixedSize(20, 20)  # Set a fixed size for the icon
-
-        prompt_label = GrowingTextEdit(input_text)
-        prompt_label.setObjectName('prompt-label')
-        prompt_label.setReadOnly(True)
-
-        prompt_layout.addWidget(prompt_icon)
-        prompt_layout.addWidget(prompt_label)  # Set a stretch factor for the prompt
-        prompt_layout.setAlignment(Qt.AlignTop)  # Align the layout to the top
-        prompt_layout.setAlignment(prompt_icon, Qt.AlignTop)
-        prompt_widget = QWidget()
-        prompt_widget.setObjectName('prompt-widget')
-        prompt_widget.setLayout(prompt_layout)
-        self.response_layout.addWidget(prompt_widget)
-        self.response_layout.setAlignment(prompt_widget, Qt.AlignTop)
-
-        # Add a new response label with the text "Answer goes here"
-        response_layout = QHBoxLayout()
-        response_layout.setContentsMargins(0, 0, 0, 0)
-        response_icon = QLabel()
-        icon = QIcon(':/icons/ai_icon.png')  # Create QIcon from the SVG file
-        pixmap = icon.pixmap(20, 20)  # Create QPixmap from QIcon
-        response_icon.setPixmap(pixmap)  # Set QPixmap as the icon for QLabel
-        response_icon.setFixedSize(20, 20)  # Set a fixed size for the icon
-        response_label = GrowingTextEdit()
-        response_label.setObjectName('response-label')
-        response_label.setReadOnly(True)
-        response_layout.addWidget(response_icon)
-        response_layout.addWidget(response_label)  # Set a stretch factor for the response
-        response_layout.setAlignment(Qt.AlignTop)  # Align the layout to the top
-        response_layout.setAlignment(response_icon, Qt.AlignTop)
-        response_widget = QWidget()
-        response_widget.setObjectName('response-widget')
-        response_widget.setLayout(response_layout)
-        self.response_layout.addWidget(response_widget)
-        self.response_layout.setAlignment(response_widget, Qt.AlignTop)
-
-        for chunk in get_response(input_text):
-            lines = chunk.split('\n')  # Split the chunk into lines
-            lines[0] = lines[0].lstrip('\n')  # Remove leading newline character from the first line
-            chunk = '\n'.join(lines)  # Join the lines back together
-            response_label.setText(response_label.toPlainText() + chunk)  # Append the chunk to the response text
-            contents_height = response_label.document().size().height()
-            response_label.setFixedHeight(contents_height+48)  # Adjust the height based on the contents and add padding
-            QApplication.processEvents()
-        
-        response_label.setText(response_label.toPlainText())
-        contents_height = response_label.document().size().height()
-        response_label.setFixedHeight(contents_height+48)
-        # after response complete update the chat history
-        update_chat_history(input_text, response_label.toPlainText())
+        prompt = self.transcript.append_message("prompt", input_text)
+        response = self.transcript.append_message("response")
+
+        # Chunks are coalesced so the transcript is updated at most once per frame
+        buffer = ChunkBuffer(self.flush_interval, self)
+        buffer.flushed.connect(lambda text: self.append_chunks(response, text))
+
+        chat_id = self.chat_id
+        worker = ResponseWorker(input_text, session=chat_id)
+        worker.signals.chunk.connect(buffer.push)
+        # Errors are not part of the answer, they go to the status line
+        worker.signals.error.connect(self.show_error)
+        worker.signals.similar.connect(lambda prompt: self.offer_received(worker, prompt))
+        worker.signals.finished.connect(
+            lambda text: self.response_finished(worker, buffer, chat_id, input_text, prompt, response))
+        self.generations[worker] = (
+            lambda save=True: self.response_finished(worker, buffer, chat_id, input_text, prompt, response, save),
+            prompt, response)
+        self.workers.add(worker)
+        self.update_stop_button()
+        get_metrics().increment("chat_submits_total")
+        # The history is read when the worker starts, so it includes the
+        # answers to questions queued before this one
+        self.scheduler.submit(chat_id, worker, lambda worker: self.prepare_worker(worker, chat_id))
+
+    def append_chunks(self, response, text):
+        with timed("chat_flush_seconds"):
+            self.transcript.append_text(response, text)
+
+    def prepare_worker(self, worker, chat_id):
+        worker.history = list(self.store.get_content(chat_id))
+
+    def show_queue_position(self):
+        positions = [self.scheduler.position(worker) for worker in self.generations
+                     if worker.session == self.chat_id]
+        positions = [position for position in positions if position is not None]
+        if positions:
+            self.set_status(f"Waiting for the model, position {min(positions)} in the queue")
+            self.queue_status = True
+        elif self.queue_status:
+            self.queue_status = False
+            self.status_label.hide()
+
+    def offer_received(self, worker, prompt):
+        if worker in self.generations:
+            self.offers[worker] = prompt
+            self.show_offer()
+
+    def current_offer(self):
+        # The oldest offer of the session on screen, the others wait for it
+        for worker in self.offers:
+            if worker.session == self.chat_id:
+                return worker
+        return None
+
+    def show_offer(self):
+        worker = self.current_offer()
+        if worker is None:
+            self.offer_bar.hide()
+            return
+        prompt = self.offers[worker]
+        self.offer_label.setText(f"A similar question was answered before: \"{prompt}\"" if prompt
+                                 else "A similar question was answered before")
+        self.offer_bar.show()
+
+    def decide_offer(self, use_cached):
+        worker = self.current_offer()
+        if worker is not None:
+            del self.offers[worker]
+            worker.decide(use_cached)
+        self.show_offer()
+
+    def cancel_all(self):
+        # Nothing is left running or waiting for an offer on the pool threads
+        for worker in list(self.generations):
+            worker.cancel()
+
+    def show_error(self, error):
+        self.set_status(f"Could not get an answer: {error}")
+
+    def update_stop_button(self):
+        # Stop is for the answers of the session on screen
+        self.stop_button.setVisible(any(worker.session == self.chat_id for worker in self.generations))
+
+    def stop_generation(self):
+        # The answer streaming in the session on screen ends here with what
+        # has arrived so far, its worker closes the stream in the background.
+        # Questions of the session still queued are dropped, never sent.
+        get_metrics().increment("chat_stops_total")
+        stopped = [(worker, finish) for worker, (finish, prompt, response) in self.generations.items()
+                   if worker.session == self.chat_id]
+        # Queued ones first, finishing the running one would start the next
+        stopped.sort(key=lambda entry: self.scheduler.position(entry[0]) is None)
+        for worker, finish in stopped:
+            queued = self.scheduler.position(worker) is not None
+            worker.cancel()
+            finish(save=not queued)
+
+    def response_finished(self, worker, buffer, chat_id, input_text, prompt, response, save=True):
+        if self.generations.pop(worker, None) is None:
+            return  # already stopped
+        self.workers.discard(worker)
+        if self.offers.pop(worker, None) is not None:
+            self.show_offer()
+        # Chunks still queued from a stopped worker are dropped
+        worker.signals.blockSignals(True)
+        buffer.flush()
+        buffer.flushed.disconnect()
+        buffer.deleteLater()
+        self.update_stop_button()
+        if not save:
+            self.transcript.remove_item(prompt)
+            self.transcript.remove_item(response)
+            self.scheduler.done(worker)
+            return
+        # A copy, a stopped worker may still be finishing its own
+        metrics = dict(worker.metrics) or None
+        if metrics:
+            self.transcript.set_metrics(response, metrics)
+        # after response complete update the chat history, a failed answer
+        # is not kept, it would be sent back to the model as its own turn
+        if worker.error is None:
+            self.store.add_message(chat_id, input_text, response["text"], metrics)
+        # The next question of the session reads the history, answer included
+        self.scheduler.done(worker)
 
     def clear_input(self):
         input_widget = self.layout.itemAt(1).widget()
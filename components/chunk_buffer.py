@@ -0,0 +1,29 @@
+from PySide6.QtCore import QObject, QTimer, Signal
+
+# Roughly one display frame at 60 Hz
+FRAME_INTERVAL_MS = 16
+
+
+class ChunkBuffer(QObject):
+    # Collects streamed chunks and hands them to the UI at most once per frame
+    flushed = Signal(str)
+
+    def __init__(self, interval=FRAME_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.pending = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def push(self, chunk):
+        self.pending.append(chunk)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        self.timer.stop()
+        if self.pending:
+            text = ''.join(self.pending)
+            self.pending = []
+            self.flushed.emit(text)
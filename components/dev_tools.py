@@ -0,0 +1,116 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from contextlib import contextmanager
+
+from PySide6.QtCore import QObject
+
+from components.frame_monitor import HEARTBEAT_MS
+
+# A UI thread block longer than this is logged with a stack sample
+STALL_THRESHOLD_MS = 200
+PROFILE_DIR = "profiles"
+# Lines of the profile and of the allocation report that are printed
+REPORT_LINES = 20
+
+
+class EventLoopWatchdog(QObject):
+    # A checker thread that samples the UI thread's stack once the frame
+    # monitor's heartbeat is overdue, so the log shows what was blocking
+    # while it still is.
+    def __init__(self, monitor, threshold_ms=STALL_THRESHOLD_MS, parent=None):
+        super().__init__(parent)
+        self.monitor = monitor
+        self.threshold = threshold_ms / 1000
+        self.main_thread = threading.main_thread().ident
+        self.stalled_since = None
+        monitor.heartbeat.connect(self.beat)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, name="event-loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def beat(self, now):
+        stalled_since = self.stalled_since
+        if stalled_since is not None:
+            self.stalled_since = None
+            print(f"[watchdog] UI thread was blocked for {(now - stalled_since) * 1000:.0f} ms",
+                  file=sys.stderr)
+
+    def watch(self):
+        while not self.stopped.wait(HEARTBEAT_MS / 1000):
+            last_beat = self.monitor.last
+            overdue = time.perf_counter() - last_beat - HEARTBEAT_MS / 1000
+            if overdue > self.threshold and self.stalled_since is None:
+                self.stalled_since = last_beat
+                frame = sys._current_frames().get(self.main_thread)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                print(f"[watchdog] UI thread blocked for over {overdue * 1000:.0f} ms in:\n{stack}",
+                      file=sys.stderr)
+
+    def stop(self):
+        self.stopped.set()
+        self.monitor.heartbeat.disconnect(self.beat)
+
+
+class HotPathProfiler:
+    # While enabled, each profiled() interaction runs under cProfile and
+    # tracemalloc; the .prof file goes to PROFILE_DIR and a summary to stderr.
+    # Only the calling thread is profiled, work on the pool threads is not.
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self.enabled = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        print(f"[profiler] {'on' if self.enabled else 'off'}", file=sys.stderr)
+
+    @contextmanager
+    def profile(self, name):
+        if not self.enabled or tracemalloc.is_tracing():
+            # Nested interactions are part of the outer profile
+            yield
+            return
+        profile = cProfile.Profile()
+        tracemalloc.start()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.dump(name, profile, snapshot, elapsed, peak)
+
+    def dump(self, name, profile, snapshot, elapsed, peak):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        profile.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(REPORT_LINES)
+        allocations = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        lines = [str(statistic) for statistic in allocations.statistics("lineno")[:REPORT_LINES]]
+        print(f"[profiler] {name}: {elapsed * 1000:.1f} ms, peak {peak / 1024:.0f} KiB allocated, "
+              f"saved {path}\n{report.getvalue()}\n" + "\n".join(lines), file=sys.stderr)
+
+
+_profiler = None
+
+
+def get_profiler():
+    global _profiler
+    if _profiler is None:
+        _profiler = HotPathProfiler()
+    return _profiler
+
+
+def profiled(name):
+    return get_profiler().profile(name)
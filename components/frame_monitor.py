@@ -0,0 +1,42 @@
+import time
+
+from PySide6.QtCore import QObject, QTimer, Signal
+from PySide6.QtWidgets import QApplication
+
+from backend.metrics import get_metrics
+
+# How often the event loop is expected to run the heartbeat
+HEARTBEAT_MS = 50
+# A heartbeat later than this counts as a stall of the UI thread
+STALL_MS = 50
+# Heartbeats between samples of the widget count
+WIDGET_SAMPLE_BEATS = 20
+
+
+class FrameMonitor(QObject):
+    # Measures how late a repeating timer fires on the UI thread. Anything that
+    # blocks the event loop delays it, so lateness is the length of the stall.
+    # The DEV_MODE watchdog shares this heartbeat.
+    heartbeat = Signal(float)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.beats = 0
+        self.last = time.perf_counter()
+        self.timer = QTimer(self)
+        self.timer.setInterval(HEARTBEAT_MS)
+        self.timer.timeout.connect(self.beat)
+        self.timer.start()
+
+    def beat(self):
+        now = time.perf_counter()
+        late = now - self.last - HEARTBEAT_MS / 1000
+        self.last = now
+        metrics = get_metrics()
+        if late * 1000 > STALL_MS:
+            metrics.increment("ui_stalls_total")
+            metrics.observe("ui_stall_seconds", late)
+        self.beats += 1
+        if self.beats % WIDGET_SAMPLE_BEATS == 0:
+            metrics.set("ui_widgets", len(QApplication.allWidgets()))
+        self.heartbeat.emit(now)
@@ -0,0 +1,49 @@
+import os
+
+from PySide6.QtCore import QObject, QFileSystemWatcher, QTimer
+
+from backend.history import HistoryWriteError
+
+# One save usually fires several notifications, wait for them to settle
+DEBOUNCE_MS = 250
+
+
+class HistoryWatcher(QObject):
+    # Reloads the store when another process changes the history files.
+    # Notifications are debounced, and the backend decides whether the files
+    # changed beyond the writes this process made itself.
+    def __init__(self, store, debounce=DEBOUNCE_MS, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.paths = [os.path.abspath(path) for path in store.backend.watch_paths()]
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce)
+        self.timer.timeout.connect(self.check)
+
+        # The directory is watched too, so files that are created or replaced
+        # by a rename get picked up again
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.addPath(os.path.dirname(self.paths[0]))
+        self.watch_files()
+        self.file_watcher.fileChanged.connect(self.on_changed)
+        self.file_watcher.directoryChanged.connect(self.on_changed)
+
+    def watch_files(self):
+        watched = set(self.file_watcher.files())
+        missing = [path for path in self.paths if path not in watched and os.path.exists(path)]
+        if missing:
+            self.file_watcher.addPaths(missing)
+
+    def on_changed(self, path):
+        self.timer.start()
+
+    def check(self):
+        self.watch_files()
+        if self.store.backend.changed_externally():
+            try:
+                self.store.load()
+            except HistoryWriteError:
+                # Our own changes are not written yet, a reload would hide them
+                self.timer.start()
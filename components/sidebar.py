@@ -1,39 +1,158 @@
-import json
 import rc_icons
-from PySide6.QtCore import Qt, Signal, QFileSystemWatcher, QSize
-from PySide6.QtGui import QCursor, QIcon
-from PySide6.QtWidgets import QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLabel
-
-
-class ClickableWidget(QWidget):
-    clicked = Signal()
-
-    def __init__(self):
-        super().__init__()
-        self.setObjectName("ClickableWidget")
-
-    def mousePressEvent(self, event):
-        self.clicked.emit()
+from PySide6.QtCore import Qt, Signal, QAbstractListModel, QEvent, QModelIndex, QRect, QSize
+from PySide6.QtGui import QColor, QCursor, QIcon, QPainter
+from PySide6.QtWidgets import QWidget, QPushButton, QVBoxLayout, QLabel, QListView, QStyle, \
+    QStyledItemDelegate
+
+from backend.history import get_store
+from backend.metrics import get_metrics, timed
+from components.history_watcher import HistoryWatcher
+
+ROW_HEIGHT = 34
+ROW_MARGIN = 2
+DELETE_WIDTH = 24
+ROW_COLOR = QColor(88, 95, 161, 25)
+ROW_HOVER_COLOR = QColor(88, 95, 161, 64)
+DELETE_COLOR = QColor(239, 113, 113, 64)
+
+
+class SessionListModel(QAbstractListModel):
+    # Mirrors the store's session list as [chat_id, title] rows and applies
+    # store changes as row inserts, removals and renames
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.rows = [[session["chat_id"], session["message"]] for session in store.sessions]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.rows[index.row()][1]
+        if role == Qt.UserRole:
+            return self.rows[index.row()][0]
+        return None
+
+    def row_of(self, chat_id):
+        for row, (row_id, title) in enumerate(self.rows):
+            if row_id == chat_id:
+                return row
+        return None
+
+    def on_history_changed(self, event, session):
+        with timed("sidebar_update_seconds"):
+            if event == "created":
+                self.insert_row(len(self.rows), session)
+            elif event == "updated":
+                self.rename_row(self.row_of(session["chat_id"]), session["message"])
+            elif event == "deleted":
+                self.remove_row(self.row_of(session["chat_id"]))
+            elif event == "reloaded":
+                self.sync()
+        get_metrics().set("sidebar_rows", len(self.rows))
+
+    def insert_row(self, row, session):
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.rows.insert(row, [session["chat_id"], session["message"]])
+        self.endInsertRows()
+
+    def rename_row(self, row, title):
+        if row is None or self.rows[row][1] == title:
+            return
+        self.rows[row][1] = title
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def remove_row(self, row):
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.rows[row]
+        self.endRemoveRows()
+
+    def sync(self):
+        # Diff against the store after a reload, both lists are ordered by chat_id
+        ids = {session["chat_id"] for session in self.store.sessions}
+        for row in range(len(self.rows) - 1, -1, -1):
+            if self.rows[row][0] not in ids:
+                self.remove_row(row)
+        for row, session in enumerate(self.store.sessions):
+            if row < len(self.rows) and self.rows[row][0] == session["chat_id"]:
+                self.rename_row(row, session["message"])
+            else:
+                self.insert_row(row, session)
+
+
+class SessionDelegate(QStyledItemDelegate):
+    # Paints a history row with its delete button and reports clicks by chat_id
+    open_clicked = Signal(int)
+    delete_clicked = Signal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.trash_icon = QIcon(":/icons/trash.svg")
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def row_rect(self, rect):
+        return rect.adjusted(0, ROW_MARGIN, 0, -ROW_MARGIN)
+
+    def delete_rect(self, rect):
+        row = self.row_rect(rect)
+        return QRect(row.right() - DELETE_WIDTH - 4, row.top() + (row.height() - DELETE_WIDTH) // 2,
+                     DELETE_WIDTH, DELETE_WIDTH)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        hovered = option.state & QStyle.State_MouseOver
+        painter.setBrush(ROW_HOVER_COLOR if hovered else ROW_COLOR)
+        row = self.row_rect(option.rect)
+        painter.drawRoundedRect(row, 4, 4)
+
+        delete = self.delete_rect(option.rect)
+        painter.setBrush(DELETE_COLOR)
+        painter.drawRoundedRect(delete, 4, 4)
+        self.trash_icon.paint(painter, delete.adjusted(5, 5, -5, -5))
+
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        text_rect = row.adjusted(10, 0, -DELETE_WIDTH - 12, 0)
+        title = option.fontMetrics.elidedText(index.data(), Qt.ElideRight, text_rect.width())
+        painter.drawText(text_rect, Qt.AlignVCenter | Qt.AlignLeft, title)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            if self.delete_rect(option.rect).contains(event.position().toPoint()):
+                self.delete_clicked.emit(index.data(Qt.UserRole))
+            else:
+                self.open_clicked.emit(index.data(Qt.UserRole))
+            return True
+        return super().editorEvent(event, model, option, index)
 
 
 class Sidebar(QWidget):
-    page_content = Signal(str)
+    page_content = Signal(int)  # chat_id of the session to open
 
-    def __init__(self):
+    def __init__(self, store=None):
         super().__init__()
-        self.chat_history = []
+        self.store = store or get_store()
         self.setObjectName("sidebar")
 
         self.setMaximumWidth(250)
         self.setMinimumWidth(200)
 
-        self.history_file = "chat_history.json"
-        self.loadChatHistory()
+        # Changes made through the store (by any widget) update only the affected rows
+        self.history_model = SessionListModel(self.store, self)
+        self.store.subscribe(self.history_model.on_history_changed)
 
-        # Create a QFileSystemWatcher and add the chat_history file to it
-        self.file_watcher = QFileSystemWatcher()
-        self.file_watcher.addPath(self.history_file)
-        self.file_watcher.fileChanged.connect(self.on_file_changed)
+        # Reload when another process changes the history files
+        self.history_watcher = HistoryWatcher(self.store, parent=self)
 
         new_chat_button = QPushButton(" New Chat")
         new_chat_button.setMaximumWidth(self.maximumWidth())
@@ -46,11 +165,17 @@ class Sidebar(QWidget):
         # align center
         new_chat_button.setStyleSheet("text-align: center;")
 
-        self.history_widget = QWidget()
-        self.history_widget.setMaximumWidth(self.maximumWidth())
-        self.history_widget.setObjectName("history-widget")
-        history_layout = QVBoxLayout()
-        history_layout.setContentsMargins(2, 7.5, 2, 0)
+        self.history_view = QListView()
+        self.history_view.setMaximumWidth(self.maximumWidth())
+        self.history_view.setObjectName("history-view")
+        self.history_view.setModel(self.history_model)
+        history_delegate = SessionDelegate(self.history_view)
+        history_delegate.open_clicked.connect(self.page_content.emit)
+        history_delegate.delete_clicked.connect(self.deleteChatMessage)
+        self.history_view.setItemDelegate(history_delegate)
+        self.history_view.setUniformItemSizes(True)
+        self.history_view.setMouseTracking(True)
+        self.history_view.setCursor(QCursor(Qt.PointingHandCursor))
 
         # Add QLabel in history layout saying history
         history_label = QLabel("HISTORY")
@@ -60,109 +185,27 @@ class Sidebar(QWidget):
         # set max height for history label
         history_label.setMaximumHeight(27)
 
-        history_layout.setAlignment(Qt.Alignment.AlignTop)
-
-        self.history_widget.setLayout(history_layout)
         sidebar_layout = QVBoxLayout()
         sidebar_layout.addWidget(new_chat_button)
         sidebar_layout.addWidget(history_label)
-        sidebar_layout.addWidget(self.history_widget)
+        sidebar_layout.addWidget(self.history_view)
         self.setLayout(sidebar_layout)
 
         new_chat_button.clicked.connect(
             lambda: self.addChatToHistoryAndEmitSignal("New Chat Session"))
-        self.updateHistoryWidget()
-
-    def on_file_changed(self, path):
-        # When the chat_history file changes, reload the chat history and update the history widget
-        if path == self.history_file:
-            self.loadChatHistory()
-            self.updateHistoryWidget()
-
-    def newButton(self, text="Button", chat_message=None):
-        if chat_message is None:
-            content = []
-        button = QPushButton(self)
-        button.setObjectName("chat-button")
-        button.setText(text)
-        button.setStyleSheet("text-align: left;")
-        # print idx when button is clicked
-        # button.clicked.connect(lambda x: print("Button clicked: ", idx))
-        button.clicked.connect(lambda x: self.page_content.emit(json.dumps(chat_message)))
-        return button
-
-    def loadChatHistory(self):
-        try:
-            with open(self.history_file, 'r') as file:
-                self.chat_history = json.load(file)
-        except FileNotFoundError:
-            self.saveChatHistory()
-
-    def saveChatHistory(self):
-        with open(self.history_file, 'w') as file:
-            json.dump(self.chat_history, file)
 
     def addChatToHistory(self, message="template message"):
-        # print("Adding chat to history")
-        self.chat_history.append({"chat_id": len(self.chat_history) + 1, "message": message, "content": []})
-        # print(self.chat_history)
-        self.updateHistoryWidget()
-        self.saveChatHistory()
+        self.store.create_session(message)
 
     def addChatToHistoryAndEmitSignal(self, message="template message"):
-        # print("Adding chat to history")
-        new_chat = {"chat_id": len(self.chat_history) + 1, "message": message, "content": []}
-        self.chat_history.append(new_chat)
-        # print(self.chat_history)
-        self.updateHistoryWidget()
-        self.saveChatHistory()
-        self.page_content.emit(json.dumps(new_chat))  # Emit the signal with the new chat session
+        new_chat = self.store.create_session(message)
+        self.page_content.emit(new_chat["chat_id"])  # Emit the signal with the new chat session
 
     def updateHistoryWidget(self):
+        # Bring the list in line with the store, touching only rows that differ
+        with timed("sidebar_update_seconds"):
+            self.history_model.sync()
 
-        # clear the layout first
-        for i in reversed(range(self.history_widget.layout().count())):
-            self.history_widget.layout().itemAt(i).widget().setParent(None)
-
-        for chat_message in self.chat_history:
-            # Create a new widget for each chat message
-            message_widget = ClickableWidget()
-            message_widget.setAttribute(Qt.WA_StyledBackground, True)
-            message_widget.clicked.connect(
-                lambda chat=chat_message: self.sendSignal(chat))
-            message_layout = QHBoxLayout()
-            message_widget.setLayout(message_layout)
-            message_widget.setObjectName("message-widget")
-            message_widget.setCursor(QCursor(Qt.PointingHandCursor))
-            message_layout.setContentsMargins(0, 0, 0, 0)
-
-            # Create the chat button
-            chat_button = self.newButton(chat_message["message"], chat_message)
-            message_layout.addWidget(chat_button, stretch=1)
-
-            # Create the delete button
-            delete_button = QPushButton("")
-            delete_button.setCursor(QCursor(Qt.PointingHandCursor))
-            delete_button.setIcon(QIcon(":/icons/trash.svg"))
-            delete_button.setObjectName("delete-button")
-            delete_button.setMaximumWidth(24)
-            delete_button.clicked.connect(lambda: self.deleteChatMessage(chat_message))
-            message_layout.addWidget(delete_button)
-
-            # Add the message widget to the history widget
-            self.history_widget.layout().addWidget(message_widget)
-
-        self.history_widget.setLayout(self.history_widget.layout())
-
-    def deleteChatMessage(self, chat_message):
-        # Remove the chat message from the chat history
-        self.chat_history.remove(chat_message)
-        # remove the chat message from json file
-        self.saveChatHistory()
-
-        # Update the history widget
-        self.updateHistoryWidget()
-
-    def sendSignal(self, chat_message):
-        # print("Sending signal", chat_message)
-        self.page_content.emit(json.dumps(chat_message))
+    def deleteChatMessage(self, chat_id):
+        # Remove the chat from the history, the store removes its row
+        self.store.delete_session(chat_id)
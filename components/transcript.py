@@ -0,0 +1,344 @@
+import math
+from collections import OrderedDict
+
+import rc_icons
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QPersistentModelIndex, QRect, QRectF, \
+    QSize, QTimer
+from PySide6.QtGui import QAbstractTextDocumentLayout, QColor, QGuiApplication, QIcon, \
+    QKeySequence, QPainter, QPalette, QTextCursor, QTextDocument
+from PySide6.QtWidgets import QAbstractItemView, QFrame, QListView, QStyle, QStyledItemDelegate, QTextEdit
+
+ICON_SIZE = 20
+SPACING = 6  # between the icon and the bubble, and between rows
+PADDING_X = 8
+PADDING_Y = 5
+BUBBLE_COLOR = QColor(88, 95, 161, 64)
+SELECTED_BUBBLE_COLOR = QColor(88, 95, 161, 128)
+FOCUS_COLOR = QColor(157, 172, 255)
+FOOTER_COLOR = QColor(160, 164, 190)
+# Laid out documents kept for painting, roughly a few screens of messages
+DOCUMENT_CACHE_SIZE = 64
+
+
+def format_metrics(metrics):
+    # One line of generation timings for under a response
+    parts = []
+    if metrics.get("cached"):
+        parts.append("cached")
+    if metrics.get("ttft") is not None:
+        parts.append(f"first token {metrics['ttft']:.2f} s")
+    if metrics.get("tokens_per_second"):
+        parts.append(f"{metrics['tokens_per_second']:.1f} tokens/s")
+    if metrics.get("eval_count"):
+        parts.append(f"{metrics['eval_count']} tokens")
+    if metrics.get("prompt_eval_duration") is not None:
+        parts.append(f"prefill {metrics['prompt_eval_duration']:.2f} s")
+    if metrics.get("load_duration"):
+        parts.append(f"load {metrics['load_duration']:.2f} s")
+    return " · ".join(parts)
+
+
+class TranscriptModel(QAbstractListModel):
+    # One row per prompt or response, items are {"role", "text"} dicts.
+    # Responses can also carry the "metrics" they were generated with.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.items[index.row()]["text"]
+        return None
+
+    def flags(self, index):
+        # Editable only so the delegate can open a read-only editor to select text in
+        return super().flags(index) | Qt.ItemIsEditable
+
+    def set_messages(self, content):
+        self.beginResetModel()
+        self.items = []
+        for item in content:
+            self.items.append({"role": "prompt", "text": item["prompt"]})
+            response = {"role": "response", "text": item["response"]}
+            if item.get("metrics"):
+                response["metrics"] = item["metrics"]
+            self.items.append(response)
+        self.endResetModel()
+
+    def append_message(self, role, text=""):
+        return self.append_item({"role": role, "text": text})
+
+    def append_item(self, item):
+        # Also puts back an item that is still streaming after set_messages
+        row = len(self.items)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.items.append(item)
+        self.endInsertRows()
+        return item
+
+    def remove_item(self, item):
+        row = self.row_of(item)
+        if row is not None:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.items[row]
+            self.endRemoveRows()
+
+    def append_text(self, item, text):
+        # The item keeps growing even when its session is no longer shown
+        item["text"] += text
+        row = self.row_of(item)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def set_metrics(self, item, metrics):
+        item["metrics"] = metrics
+        item.pop("height", None)
+        row = self.row_of(item)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def row_of(self, item):
+        # Streaming items sit at the end, so search backwards
+        for row in range(len(self.items) - 1, -1, -1):
+            if self.items[row] is item:
+                return row
+        return None
+
+
+class MessageDelegate(QStyledItemDelegate):
+    # Paints a message as an icon and a rounded bubble. Rows that have never
+    # been painted get an estimated height from font metrics; painting lays
+    # the text out exactly, caches the height on the item and asks the view
+    # to relayout if the estimate was off. Double-clicking a message opens a
+    # read-only QTextEdit over its text so part of it can be selected and copied.
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.icons = {
+            "prompt": QIcon(':/icons/user_icon.svg').pixmap(ICON_SIZE, ICON_SIZE),
+            "response": QIcon(':/icons/ai_icon.png').pixmap(ICON_SIZE, ICON_SIZE),
+        }
+        self.documents = OrderedDict()  # id(item) -> (item, document, laid out length)
+        self.relayout_pending = False
+        self.editing = QPersistentModelIndex()
+
+    def text_width(self):
+        return max(1, self.view.viewport().width() - ICON_SIZE - SPACING - 2 * PADDING_X)
+
+    def row_height(self, text_height, footer=False):
+        height = max(ICON_SIZE, math.ceil(text_height) + 2 * PADDING_Y) + SPACING
+        if footer:
+            height += self.footer_height()
+        return height
+
+    def footer(self, item):
+        if self.view.show_metrics and item.get("metrics"):
+            return format_metrics(item["metrics"])
+        return None
+
+    def footer_height(self):
+        return self.view.fontMetrics().lineSpacing()
+
+    def estimate_height(self, text, metrics, width, footer=False):
+        # Average character width instead of shaping the text, it is corrected on paint
+        chars_per_line = max(1, width // max(1, metrics.averageCharWidth()))
+        lines = 0
+        for paragraph in text.split('\n'):
+            lines += max(1, math.ceil(len(paragraph) / chars_per_line))
+        return self.row_height(lines * metrics.lineSpacing(), footer)
+
+    def document(self, item, font, width):
+        entry = self.documents.pop(id(item), None)
+        if entry is None or entry[0] is not item:
+            document = QTextDocument()
+            document.setDocumentMargin(0)
+            document.setDefaultFont(font)
+            document.setPlainText(item["text"])
+        else:
+            document = entry[1]
+            if entry[2] < len(item["text"]):
+                # Streamed text only grows, append the new part at the end
+                cursor = QTextCursor(document)
+                cursor.movePosition(QTextCursor.MoveOperation.End)
+                cursor.insertText(item["text"][entry[2]:])
+        if document.textWidth() != width:
+            document.setTextWidth(width)
+        self.documents[id(item)] = (item, document, len(item["text"]))
+        while len(self.documents) > DOCUMENT_CACHE_SIZE:
+            self.documents.popitem(last=False)
+        return document
+
+    def sizeHint(self, option, index):
+        item = self.view.model().items[index.row()]
+        width = self.text_width()
+        cached = item.get("height")
+        if cached is None or cached[0] != width or cached[2] != len(item["text"]):
+            footer = self.footer(item) is not None
+            if id(item) in self.documents:
+                # Already laid out (e.g. the streaming answer), extend it exactly
+                height = self.row_height(self.document(item, option.font, width).size().height(), footer)
+                cached = (width, height, len(item["text"]), True)
+            else:
+                cached = (width, self.estimate_height(item["text"], option.fontMetrics, width, footer),
+                          len(item["text"]), False)
+            item["height"] = cached
+        return QSize(width, cached[1])
+
+    def paint(self, painter, option, index):
+        item = self.view.model().items[index.row()]
+        width = self.text_width()
+        document = self.document(item, option.font, width)
+        footer = self.footer(item)
+        height = self.row_height(document.size().height(), footer is not None)
+        if item.get("height") != (width, height, len(item["text"]), True):
+            if height != option.rect.height():
+                self.schedule_relayout()
+            item["height"] = (width, height, len(item["text"]), True)
+
+        painter.save()
+        painter.setClipRect(option.rect)
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = option.rect
+        painter.drawPixmap(rect.x(), rect.y(), self.icons[item["role"]])
+        footer_height = self.footer_height() if footer is not None else 0
+        bubble = QRect(rect.x() + ICON_SIZE + SPACING, rect.y(), width + 2 * PADDING_X,
+                       height - SPACING - footer_height)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(SELECTED_BUBBLE_COLOR if option.state & QStyle.State_Selected else BUBBLE_COLOR)
+        painter.drawRoundedRect(bubble, 4, 4)
+        if option.state & QStyle.State_HasFocus and self.view.hasFocus():
+            painter.setPen(FOCUS_COLOR)
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRoundedRect(QRectF(bubble).adjusted(0.5, 0.5, -0.5, -0.5), 4, 4)
+        if footer is not None:
+            painter.setPen(FOOTER_COLOR)
+            painter.drawText(QRect(bubble.x() + PADDING_X, bubble.bottom() + 1, width, footer_height),
+                             Qt.AlignLeft | Qt.AlignVCenter, footer)
+        if self.editing == index:
+            # The editor shows the text on top of the bubble
+            painter.restore()
+            return
+        painter.translate(bubble.x() + PADDING_X, bubble.y() + PADDING_Y)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(QPalette.Text, option.palette.color(QPalette.Text))
+        # Only draw the blocks of a long answer that are on screen
+        visible = QRectF(rect.intersected(self.view.viewport().rect()))
+        context.clip = visible.translated(-bubble.x() - PADDING_X, -bubble.y() - PADDING_Y)
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+
+    def createEditor(self, parent, option, index):
+        editor = QTextEdit(parent)
+        editor.setObjectName('transcript-editor')
+        editor.setReadOnly(True)
+        editor.setFrameShape(QFrame.NoFrame)
+        editor.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        editor.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        editor.setFont(option.font)
+        editor.document().setDocumentMargin(0)
+        self.editing = QPersistentModelIndex(index)
+        return editor
+
+    def setEditorData(self, editor, index):
+        text = self.view.model().items[index.row()]["text"]
+        current = editor.toPlainText()
+        if current and text.startswith(current):
+            # A streaming answer, keep the user's selection while it grows
+            cursor = QTextCursor(editor.document())
+            cursor.movePosition(QTextCursor.MoveOperation.End)
+            cursor.insertText(text[len(current):])
+        elif text != current:
+            editor.setPlainText(text)
+
+    def setModelData(self, editor, model, index):
+        pass
+
+    def updateEditorGeometry(self, editor, option, index):
+        item = self.view.model().items[index.row()]
+        footer_height = self.footer_height() if self.footer(item) is not None else 0
+        rect = option.rect
+        editor.setGeometry(rect.x() + ICON_SIZE + SPACING + PADDING_X, rect.y() + PADDING_Y,
+                           self.text_width(), rect.height() - SPACING - footer_height - 2 * PADDING_Y)
+
+    def destroyEditor(self, editor, index):
+        self.editing = QPersistentModelIndex()
+        super().destroyEditor(editor, index)
+
+    def schedule_relayout(self):
+        # Layout can't change while painting, so it runs once after this paint
+        if not self.relayout_pending:
+            self.relayout_pending = True
+            QTimer.singleShot(0, self.relayout)
+
+    def relayout(self):
+        self.relayout_pending = False
+        self.view.scheduleDelayedItemsLayout()
+
+
+class TranscriptView(QListView):
+    # Chat transcript that only lays out and paints the visible messages
+    def __init__(self, parent=None, show_metrics=False):
+        super().__init__(parent)
+        self.setObjectName('transcript-view')
+        # Generation timings are drawn under responses that have them
+        self.show_metrics = show_metrics
+        self.transcript = TranscriptModel(self)
+        self.setModel(self.transcript)
+        self.setItemDelegate(MessageDelegate(self))
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.verticalScrollBar().setSingleStep(20)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.Adjust)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.DoubleClicked)
+
+        # Stay pinned to the newest message unless the user scrolls up
+        self.follow_bottom = True
+        self.verticalScrollBar().rangeChanged.connect(self.keep_at_bottom)
+        self.verticalScrollBar().valueChanged.connect(self.track_bottom)
+
+    def set_messages(self, content):
+        self.transcript.set_messages(content)
+        self.scroll_to_bottom()
+
+    def append_message(self, role, text=""):
+        item = self.transcript.append_message(role, text)
+        self.scroll_to_bottom()
+        return item
+
+    def append_item(self, item):
+        self.transcript.append_item(item)
+        self.scroll_to_bottom()
+
+    def remove_item(self, item):
+        self.transcript.remove_item(item)
+
+    def append_text(self, item, text):
+        self.transcript.append_text(item, text)
+
+    def set_metrics(self, item, metrics):
+        self.transcript.set_metrics(item, metrics)
+
+    def scroll_to_bottom(self):
+        self.follow_bottom = True
+        self.scrollToBottom()
+
+    def keep_at_bottom(self, minimum, maximum):
+        if self.follow_bottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def track_bottom(self, value):
+        self.follow_bottom = value >= self.verticalScrollBar().maximum()
+
+    def keyPressEvent(self, event):
+        # Messages are painted, not QTextEdits, so copy the selected one as text.
+        # Part of a message is copied from the editor a double-click opens.
+        if event.matches(QKeySequence.Copy) and self.currentIndex().isValid():
+            QGuiApplication.clipboard().setText(self.transcript.items[self.currentIndex().row()]["text"])
+            return
+        super().keyPressEvent(event)
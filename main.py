@@ -1,14 +1,18 @@
 import os
 import sys
-import json
 from PySide6.QtCore import Qt, QFileSystemWatcher, QSize
-from PySide6.QtGui import QIcon
+from PySide6.QtGui import QIcon, QKeySequence, QShortcut
 from PySide6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QFileDialog, QLabel, QSplitter, QSizePolicy,
-                             QScrollArea)
+                             QScrollArea, QMessageBox)
 from PySide6.QtPdf import QPdfDocument
 from PySide6.QtPdfWidgets import QPdfView
+from backend.history import HistoryWriteError, get_store
+from backend.main import get_client
+from backend.metrics import METRICS_PORT, get_metrics, serve_metrics, timed
 from components.chat_widget import ChatWidget
+from components.dev_tools import EventLoopWatchdog, get_profiler, profiled
+from components.frame_monitor import FrameMonitor
 
 # Set DEV_MODE to True for live update, False for no live update
 DEV_MODE = True
@@ -53,16 +57,22 @@ class PDFReader(QWidget):
         file_name, _ = QFileDialog.getOpenFileName(
             self, "Select PDF", "", "PDF Files (*.pdf)")
         if file_name:
-            # Load PDF file into viewer
+            self.load_pdf(file_name)
+
+    def load_pdf(self, file_name):
+        # Load PDF file into viewer
+        with timed("pdf_load_seconds"), profiled("loadPdf"):
             self.pdf_document.load(file_name)
             
             # Update PDF view after loading
             self.pdf_view.setPageMode(QPdfView.PageMode.MultiPage)
             self.pdf_view.setZoomMode(QPdfView.ZoomMode.FitToWidth)
+        get_metrics().increment("pdf_loads_total")
+        get_metrics().set("pdf_pages", self.pdf_document.pageCount())
 
 class ResizableChat(ChatWidget):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, store=None):
+        super().__init__(store)
         # Set size policy and minimum width for chat
         self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.setMinimumWidth(150)
@@ -74,10 +84,10 @@ class Window(QWidget):
         self.setWindowIcon(QIcon(':/icons/ai_icon.png'))
         self.setObjectName("window")
         
-        # Initialize chat history
-        self.chat_history = []
-        self.history_file = "chat_history.json"
-        self.loadChatHistory()
+        # Chat history is shared with the chat widget through one store
+        self.store = get_store()
+        # One Ollama client for the whole session, its connections are reused
+        self.client = get_client()
         
         # Create main layout
         main_layout = QVBoxLayout()
@@ -91,7 +101,7 @@ class Window(QWidget):
         self.splitter.addWidget(self.pdf_reader)
         
         # Initialize chat widget with new ResizableChat class
-        self.chat = ResizableChat()
+        self.chat = ResizableChat(self.store)
         self.chat.setAttribute(Qt.WA_StyledBackground, True)
         self.splitter.addWidget(self.chat)
         
@@ -110,7 +120,7 @@ class Window(QWidget):
         self.resize(1200, 600)
         
         # Create initial chat session if none exists
-        if not self.chat_history:
+        if not self.store.sessions:
             self.createInitialChat()
         else:
             # Load the most recent chat
@@ -133,31 +143,14 @@ class Window(QWidget):
             }
         """)
 
-    def loadChatHistory(self):
-        try:
-            with open(self.history_file, 'r') as file:
-                self.chat_history = json.load(file)
-        except FileNotFoundError:
-            self.saveChatHistory()
-
-    def saveChatHistory(self):
-        with open(self.history_file, 'w') as file:
-            json.dump(self.chat_history, file)
-
     def createInitialChat(self):
-        initial_chat = {
-            "chat_id": 1,
-            "message": "Chat Session",
-            "content": []
-        }
-        self.chat_history.append(initial_chat)
-        self.saveChatHistory()
-        self.chat.changePage(json.dumps(initial_chat))
+        initial_chat = self.store.create_session("Chat Session")
+        self.chat.changePage(initial_chat["chat_id"])
 
     def loadMostRecentChat(self):
-        if self.chat_history:
-            most_recent_chat = self.chat_history[-1]
-            self.chat.changePage(json.dumps(most_recent_chat))
+        most_recent_chat = self.store.latest()
+        if most_recent_chat:
+            self.chat.changePage(most_recent_chat["chat_id"])
 
 
 if __name__ == "__main__":
@@ -179,6 +172,35 @@ if __name__ == "__main__":
 
         watcher.fileChanged.connect(update_stylesheet)
 
+    if DEV_MODE or METRICS_PORT:
+        # One heartbeat on the UI thread for the stall metrics and the watchdog
+        frame_monitor = FrameMonitor(app)
+
+    if DEV_MODE:
+        # Logs UI thread blocks with a stack sample of the blocking code
+        watchdog = EventLoopWatchdog(frame_monitor, parent=app)
+
+    if METRICS_PORT:
+        # Opt-in, Prometheus text on http://127.0.0.1:METRICS_PORT/metrics
+        metrics_server = serve_metrics(METRICS_PORT)
+
     window = Window()
+    # Pending history writes are flushed before the process exits
+    app.aboutToQuit.connect(window.chat.cancel_all)
+    def close_store():
+        # The last chance to tell the user, a windowed build has no console
+        try:
+            window.store.close()
+        except HistoryWriteError as error:
+            QMessageBox.critical(window, "Chat history", str(error))
+
+    app.aboutToQuit.connect(close_store)
+    app.aboutToQuit.connect(window.client.close)
+    if DEV_MODE:
+        # Ctrl+Shift+P profiles submit, changePage and PDF loads until pressed again
+        profiler_shortcut = QShortcut(QKeySequence("Ctrl+Shift+P"), window)
+        profiler_shortcut.activated.connect(get_profiler().toggle)
     window.show()
+    # Ollama loads the model in the background while the window is up
+    window.chat.warm_up()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,157 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ollama
+import pytest
+
+from backend.endpoints import Cancellation, Cancelled, EndpointPool
+
+
+def chunk(content, done=False):
+    return {
+        "model": "m",
+        "created_at": "2024-01-01T00:00:00Z",
+        "message": {"role": "assistant", "content": content},
+        "done": done,
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Answers /api/chat like Ollama does; the server's attributes decide how
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests += 1
+        if self.server.status != 200:
+            body = json.dumps({"error": "stub error"}).encode()
+            self.send_response(self.server.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.server.delay:
+            # Prefill: nothing is sent, but a client hanging up is noticed
+            self.connection.settimeout(self.server.delay)
+            try:
+                if self.connection.recv(1) == b"":
+                    self.server.disconnected.set()
+                    return
+            except OSError:
+                pass
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for data in [chunk("hello "), chunk("world"), chunk("", done=True)]:
+            line = (json.dumps(data) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(status=200, delay=0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        server.daemon_threads = True
+        server.status = status
+        server.delay = delay
+        server.requests = 0
+        server.disconnected = threading.Event()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, "http://127.0.0.1:%d" % server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def unreachable_host():
+    # A port that was just free, with nothing listening on it
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return "http://127.0.0.1:%d" % port
+
+
+def chat(pool, **kwargs):
+    stream = pool.stream("chat", model="m", messages=[{"role": "user", "content": "hi"}], **kwargs)
+    return "".join(part["message"]["content"] for part in stream)
+
+
+def test_needs_a_host():
+    with pytest.raises(ValueError):
+        EndpointPool([])
+
+
+def test_unreachable_server_fails_over(stub_server, unreachable_host):
+    _, good = stub_server()
+    pool = EndpointPool([unreachable_host, good])
+    assert chat(pool) == "hello world"
+    dead, alive = pool.endpoints
+    assert dead.failed_at is not None
+    assert alive.failed_at is None
+    assert dead.in_flight == alive.in_flight == 0
+    # The failed server is skipped on the next request
+    assert pool.acquire() is alive
+    pool.release(alive)
+
+
+def test_server_error_fails_over(stub_server):
+    broken, broken_host = stub_server(status=500)
+    good, good_host = stub_server()
+    pool = EndpointPool([broken_host, good_host])
+    assert chat(pool) == "hello world"
+    assert broken.requests == 1
+    assert pool.endpoints[0].failed_at is not None
+    assert pool.endpoints[1].failed_at is None
+
+
+def test_client_error_keeps_server_in_rotation(stub_server):
+    _, missing_host = stub_server(status=404)
+    _, good_host = stub_server()
+    pool = EndpointPool([missing_host, good_host])
+    assert chat(pool) == "hello world"
+    assert pool.endpoints[0].failed_at is None
+    with pytest.raises(ollama.ResponseError) as raised:
+        EndpointPool([missing_host]).call("chat", model="m", messages=[])
+    assert raised.value.status_code == 404
+
+
+def test_slow_first_token(stub_server):
+    _, host = stub_server(delay=0.5)
+    pool = EndpointPool([host])
+    assert chat(pool) == "hello world"
+    endpoint = pool.endpoints[0]
+    assert endpoint.ttft >= 0.5
+    assert endpoint.failed_at is None
+    assert endpoint.in_flight == 0
+
+
+def test_cancel_before_first_token(stub_server):
+    server, host = stub_server(delay=5)
+    pool = EndpointPool([host])
+    cancellation = Cancellation()
+    threading.Timer(0.2, cancellation.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(Cancelled):
+        chat(pool, cancellation=cancellation)
+    assert time.monotonic() - started < 2
+    # The server sees the connection go away instead of generating on
+    assert server.disconnected.wait(2)
+    endpoint = pool.endpoints[0]
+    assert endpoint.failed_at is None
+    assert endpoint.in_flight == 0